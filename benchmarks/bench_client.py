@@ -0,0 +1,188 @@
+# Copyright 2023 - Ikhsan Maulana
+"""
+Throughput and latency of the clients against the local mock exchange (benchmarks/mock_exchange.py), per endpoint
+and client mode: requests/sec, p50 / p99 latency and client CPU per call. The mock runs in its own process, so the
+CPU column only counts the client (request preparation, signing, I/O and parsing the answer).
+
+    python benchmarks/bench_client.py
+    python benchmarks/bench_client.py --modes plain,models --endpoints order_book,new_order --calls 2000
+    python benchmarks/bench_client.py --latency 0.02 --concurrency 32 --json results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytokocrypto  # noqa: E402
+from mock_exchange import use_mock  # noqa: E402
+
+API_KEY = "benchmark-api-key"
+SECRET_KEY = "NhqPtmdSJYdKjVHjA7PZj4Mge3R5YNiP1e3UZjInClVN65XAbvqqM6A7H5fATj0j"
+
+# name -> (client method, arguments)
+ENDPOINTS = {
+    "order_book": ("market_order_book", {"symbol": "BTC_USDT", "limit": 100}),
+    "order_book_toko": ("market_order_book", {"symbol": "TKO_IDR", "limit": 100}),
+    "recent_trades": ("market_recent_trades_list", {"symbol": "BTC_USDT", "limit": 500}),
+    "agg_trades": ("market_aggregate_trade_list", {"symbol": "BTC_USDT", "limit": 1000}),
+    "klines": ("market_candlestick_data", {"symbol": "BTC_USDT", "interval": "1m", "limit": 500}),
+    "new_order": ("account_new_order", {"symbol": "BTC_USDT", "side": 0, "type_": 1, "time_in_force": 1,
+                                        "quantity": "0.0015", "price": "27350.15"}),
+    "query_order": ("account_query_order", {"order_id": 1}),
+    "account": ("account_information", {}),
+    "trade_list": ("account_trade_list", {"symbol": "BTC_USDT", "limit": 500}),
+    "deposit_history": ("wallet_deposit_history", {"asset": "USDT"})
+}
+MODES = ("plain", "models", "cache", "resilience", "async")
+
+
+def start_exchange(args) -> (subprocess.Popen, str):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_exchange.py"),
+               "--port", "0", "--latency", str(args.latency), "--error-rate", str(args.error_rate),
+               "--secret-key", SECRET_KEY]
+    if args.weight_limit is not None:
+        command += ["--weight-limit", str(args.weight_limit)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    return process, process.stdout.readline().strip()
+
+
+def make_client(mode: str, url: str, concurrency: int):
+    if mode == "async":
+        return pytokocrypto.AsyncTokoCrypto(API_KEY, SECRET_KEY, limit_per_host=concurrency,
+                                            symbols=pytokocrypto.SymbolIndex(cache_path=None))
+    # the client side budget is lifted for the mock host, its own --weight-limit still answers 429
+    scheduler = pytokocrypto.WeightScheduler(limits={urlsplit(url).netloc: 10 ** 9})
+    kwargs = {"pool_maxsize": concurrency, "scheduler": scheduler, "symbols": pytokocrypto.SymbolIndex(cache_path=None)}
+    if mode == "models":
+        kwargs["models"] = True
+    elif mode == "cache":
+        kwargs["cache"] = pytokocrypto.ResponseCache()
+    elif mode == "resilience":
+        kwargs["resilience"] = pytokocrypto.Resilience()
+    return pytokocrypto.BaseTokoCrypto(API_KEY, SECRET_KEY, **kwargs)
+
+
+def consume(result):
+    # decode raw responses the way a caller would, so parsing is part of every mode's measurement
+    if hasattr(result, "content"):
+        return result.json()
+    return result
+
+
+def percentile(latencies: list, fraction: float) -> float:
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] if latencies else float("nan")
+
+
+def summarize(mode: str, endpoint: str, warmup: list, results: list, wall: float, cpu: float) -> dict:
+    # call() returns the latency, or the exception the call raised
+    warmup_errors = [result for result in warmup if isinstance(result, Exception)]
+    if warmup_errors:
+        print("%s %s: %d warm-up calls failed, first: %r" % (mode, endpoint, len(warmup_errors), warmup_errors[0]),
+              file=sys.stderr)
+    latencies = sorted(result for result in results if not isinstance(result, Exception))
+    calls = len(results)
+    return {"mode": mode, "endpoint": endpoint, "calls": calls, "errors": calls - len(latencies),
+            "warmup_errors": len(warmup_errors), "rps": calls / wall, "p50_ms": percentile(latencies, 0.5) * 1e3,
+            "p99_ms": percentile(latencies, 0.99) * 1e3, "cpu_us": cpu / calls * 1e6}
+
+
+def run_sync(client, mode: str, endpoint: str, calls: int, concurrency: int) -> dict:
+    method, kwargs = ENDPOINTS[endpoint]
+    func = getattr(client, method)
+
+    def call(_):
+        started = time.perf_counter()
+        try:
+            consume(func(**kwargs))
+        except Exception as e:
+            return e
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        warmup = list(executor.map(call, range(concurrency)))  # warm up connections and the symbol table
+        wall, cpu = time.perf_counter(), time.process_time()
+        results = list(executor.map(call, range(calls)))
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    return summarize(mode, endpoint, warmup, results, wall, cpu)
+
+
+async def run_async(client, mode: str, endpoint: str, calls: int, concurrency: int) -> dict:
+    method, kwargs = ENDPOINTS[endpoint]
+    func = getattr(client, method)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call():
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await func(**kwargs)
+            except Exception as e:
+                return e
+            return time.perf_counter() - started
+
+    warmup = await asyncio.gather(*(call() for _ in range(concurrency)))
+    wall, cpu = time.perf_counter(), time.process_time()
+    results = await asyncio.gather(*(call() for _ in range(calls)))
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    return summarize(mode, endpoint, warmup, results, wall, cpu)
+
+
+async def bench_async(url: str, endpoints: list, calls: int, concurrency: int) -> list:
+    client = make_client("async", url, concurrency)
+    try:
+        return [await run_async(client, "async", endpoint, calls, concurrency) for endpoint in endpoints]
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", default=",".join(MODES), help="comma separated, from %s" % ", ".join(MODES))
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma separated, from %s"
+                        % ", ".join(ENDPOINTS))
+    parser.add_argument("--calls", type=int, default=500, help="measured calls per endpoint and mode")
+    parser.add_argument("--concurrency", type=int, default=8, help="calls in flight")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of mock exchange latency per answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock answers failing")
+    parser.add_argument("--weight-limit", type=int, default=None, help="mock exchange weight limit per minute")
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    args = parser.parse_args()
+    modes, endpoints = args.modes.split(","), args.endpoints.split(",")
+    if pytokocrypto.aiohttp is None and "async" in modes:
+        modes.remove("async")
+        print("aiohttp is not installed, skipping the async mode", file=sys.stderr)
+
+    process, url = start_exchange(args)
+    results = []
+    try:
+        with use_mock(url):
+            print("%-11s %-16s %7s %6s %6s %10s %9s %9s %10s" % ("mode", "endpoint", "calls", "errors", "warmup",
+                                                                 "req/s", "p50 ms", "p99 ms", "cpu us"))
+            for mode in modes:
+                if mode == "async":
+                    rows = asyncio.run(bench_async(url, endpoints, args.calls, args.concurrency))
+                else:
+                    with make_client(mode, url, args.concurrency) as client:
+                        rows = [run_sync(client, mode, endpoint, args.calls, args.concurrency)
+                                for endpoint in endpoints]
+                for row in rows:
+                    print("%-11s %-16s %7d %6d %6d %10.1f %9.2f %9.2f %10.1f" % (
+                        row["mode"], row["endpoint"], row["calls"], row["errors"], row["warmup_errors"], row["rps"],
+                        row["p50_ms"], row["p99_ms"], row["cpu_us"]))
+                results += rows
+    finally:
+        process.terminate()
+        process.wait()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Copyright 2023 - Ikhsan Maulana
+"""
+Micro-benchmark of the per-call overhead of preparing a signed request (parameter filtering, query string,
+signature and requests' own URL preparation), without any network I/O.
+
+    python benchmarks/bench_signing.py
+"""
+import hashlib
+import hmac
+import os
+import sys
+import time
+import timeit
+from urllib.parse import urlencode
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytokocrypto  # noqa: E402
+
+SECRET_KEY = "NhqPtmdSJYdKjVHjA7PZj4Mge3R5YNiP1e3UZjInClVN65XAbvqqM6A7H5fATj0j"
+ENDPOINT_URL = pytokocrypto.BASE_URL + pytokocrypto.ACCOUNT_NEW_ORDER_URL
+
+
+def order_payload():
+    return {
+        "symbol": "BTC_USDT",
+        "side": 0,
+        "type": 1,
+        "timeInForce": 1,
+        "quantity": "0.0015",
+        "quoteOrderQty": None,
+        "price": "27350.15",
+        "clientId": None,
+        "stopPrice": None,
+        "icebergQty": None,
+        "recvWindow": 5000,
+        "timestamp": int(time.time() * 1000)
+    }
+
+
+def legacy_prepare():
+    # the request path before the request plans: filtered dict, urlencode twice, fresh HMAC per call
+    payload = order_payload()
+    parameter = dict()
+    [parameter.update({key: payload[key]}) for key in payload.keys() if payload[key]]
+    query_string = urlencode(parameter, True)
+    m = hmac.new(SECRET_KEY.encode("utf-8"), query_string.encode("utf-8"), hashlib.sha256)
+    parameter["signature"] = m.hexdigest()
+    return requests.Request("POST", url=ENDPOINT_URL, params=parameter).prepare()
+
+
+signer = pytokocrypto._Signer(SECRET_KEY)
+
+
+def plan_prepare():
+    plan = pytokocrypto._get_plan("post", ENDPOINT_URL, True)
+    return requests.Request(plan.method, plan.prepare(order_payload(), signer)).prepare()
+
+
+def plan_sign_only():
+    return pytokocrypto._get_plan("post", ENDPOINT_URL, True).prepare(order_payload(), signer)
+
+
+def main(number: int = 20000, repeat: int = 5):
+    for name, func in (("legacy", legacy_prepare), ("plan", plan_prepare), ("plan (no requests prepare)", plan_sign_only)):
+        best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+        print("%-28s %8.2f us/call" % (name, best * 1e6))
+
+
+if __name__ == "__main__":
+    main()
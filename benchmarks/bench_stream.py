@@ -0,0 +1,91 @@
+# Copyright 2023 - Ikhsan Maulana
+"""
+MarketStream against the local stand-in servers (benchmarks/mock_exchange.py: MockExchange for depth snapshots,
+MockStream for the WebSocket streams): updates/sec, delivery latency, connections opened, and a check that every
+depth book ends in sync with the server's book. A callback raising on every --raise-every'th trade and
+--drop-after forced disconnects exercise the error and reconnect paths.
+
+    python benchmarks/bench_stream.py
+    python benchmarks/bench_stream.py --seconds 10 --interval 0.001 --drop-after 2000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytokocrypto  # noqa: E402
+from mock_exchange import MockExchange, MockStream, use_mock  # noqa: E402
+
+SYMBOLS = ("BTC_USDT", "ETH_USDT", "TKO_IDR")
+
+
+async def run(client, stream_url: str, args) -> dict:
+    market = pytokocrypto.MarketStream(client, urls={pytokocrypto.ROUTE_TOKOCRYPTO: stream_url,
+                                                     pytokocrypto.ROUTE_BINANCE: stream_url},
+                                       reconnect_delay=0.05)
+    trades = [0]
+
+    def on_trade(update):
+        trades[0] += 1
+        if args.raise_every and trades[0] % args.raise_every == 0:
+            raise RuntimeError("callback failure %d" % trades[0])
+
+    books = {symbol: market.subscribe_depth(symbol, limit=100) for symbol in SYMBOLS}
+    for symbol in SYMBOLS:
+        market.subscribe_trades(symbol, callback=on_trade)
+    latencies, updates = [], 0
+    async with market:
+        deadline = time.time() + args.seconds
+        while time.time() < deadline:
+            try:
+                update = await asyncio.wait_for(market.__anext__(), timeout=max(0.0, deadline - time.time()))
+            except asyncio.TimeoutError:
+                break
+            updates += 1
+            if "E" in update.data:
+                latencies.append(time.time() * 1000 - update.data["E"])
+        await asyncio.sleep(0.2)  # let the last diffs (the server is paused by the caller) arrive
+        result = {"updates": updates, "rps": updates / args.seconds, "connects": market.connects,
+                  "callback_errors": market.callback_errors, "last_error": repr(market.last_error)}
+    latencies.sort()
+    result["p50_ms"] = latencies[len(latencies) // 2] if latencies else float("nan")
+    result["p99_ms"] = latencies[int(len(latencies) * 0.99)] if latencies else float("nan")
+    result["books"] = books
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--interval", type=float, default=0.005, help="seconds between server updates")
+    parser.add_argument("--drop-after", type=int, default=None, help="server closes connections after n messages")
+    parser.add_argument("--raise-every", type=int, default=100, help="trade callback raises every n calls, 0: never")
+    args = parser.parse_args()
+
+    with MockExchange() as exchange, MockStream(exchange, interval=args.interval, drop_after=args.drop_after) \
+            as server, use_mock(exchange.url):
+        client = pytokocrypto.BaseTokoCrypto(symbols=pytokocrypto.SymbolIndex(cache_path=None))
+        loop = asyncio.new_event_loop()
+        task = loop.create_task(run(client, server.url, args))
+        loop.call_later(args.seconds, setattr, server, "paused", True)
+        result = loop.run_until_complete(task)
+        loop.close()
+        in_sync = True
+        for symbol, book in result.pop("books").items():
+            snapshot = server.snapshot(client.symbols.route(symbol)[1], 1)
+            synced = book.last_update_id == snapshot["lastUpdateId"] and \
+                book.best_bid()[0] == float(snapshot["bids"][0][0]) and \
+                book.best_ask()[0] == float(snapshot["asks"][0][0])
+            in_sync &= synced
+            print("%-9s book update id %d, server %d, %s" % (symbol, book.last_update_id, snapshot["lastUpdateId"],
+                                                            "in sync" if synced else "OUT OF SYNC"))
+        client.close()
+    print("updates %(updates)d (%(rps).0f/s), latency p50 %(p50_ms).2f ms p99 %(p99_ms).2f ms" % result)
+    print("connections opened %(connects)d, callback errors %(callback_errors)d, last error %(last_error)s" % result)
+    sys.exit(0 if in_sync else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,581 @@
+# Copyright 2023 - Ikhsan Maulana
+"""
+Local stand-in for www.tokocrypto.com and api.binance.com, so the client can be run and benchmarked offline.
+Serves the symbols, time, market (Tokocrypto and Binance paths), account and wallet endpoints with synthetic but
+consistent data, and can add latency, random errors and exchange-style rate limiting (X-MBX-USED-WEIGHT-1M header,
+429 with Retry-After once the weight limit is spent). MockStream is the matching combined-stream WebSocket host
+(depth diffs, trades and klines) for MarketStream.
+
+    python benchmarks/mock_exchange.py --port 8000 --latency 0.005 --error-rate 0.01
+
+In a script, point the client at it with use_mock():
+
+    with MockExchange() as exchange, use_mock(exchange.url):
+        client = pytokocrypto.BaseTokoCrypto("key", "secret")
+
+and a MarketStream at a MockStream attached to the same exchange:
+
+    with MockExchange() as exchange, MockStream(exchange) as stream, use_mock(exchange.url):
+        market = pytokocrypto.MarketStream(client, urls={pytokocrypto.ROUTE_TOKOCRYPTO: stream.url,
+                                                         pytokocrypto.ROUTE_BINANCE: stream.url})
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, parse_qsl, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytokocrypto  # noqa: E402
+
+try:
+    import websockets
+except ImportError:  # only MockStream needs websockets
+    websockets = None
+
+# symbol -> type, type 1 market data is served on the Binance paths
+SYMBOLS = {"BTC_USDT": 1, "ETH_USDT": 1, "BNB_USDT": 1, "TKO_IDR": 0, "BTC_IDR": 0, "USDT_IDR": 0}
+ASSETS = ("BTC", "ETH", "BNB", "TKO", "USDT", "IDR")
+TAPE_START = 1672531200000  # 2023-01-01, first synthetic trade
+TAPE_STEP = 1000  # one synthetic trade per second
+KLINE_INTERVALS = pytokocrypto.INTERVAL_MILLISECONDS
+
+
+def _price(index: int) -> float:
+    return round(100 + 10 * math.sin(index / 3600), 2)
+
+
+def _agg_trade(index: int) -> dict:
+    return {"a": index, "p": "%.2f" % _price(index), "q": "%.4f" % (0.01 + index % 97 / 100), "f": index,
+            "l": index, "T": TAPE_START + index * TAPE_STEP, "m": index % 2 == 0, "M": True}
+
+
+def _trade(index: int) -> dict:
+    price, qty = _price(index), 0.01 + index % 97 / 100
+    return {"id": index, "price": "%.2f" % price, "qty": "%.4f" % qty, "quoteQty": "%.4f" % (price * qty),
+            "time": TAPE_START + index * TAPE_STEP, "isBuyerMaker": index % 2 == 0, "isBestMatch": True}
+
+
+def _kline(open_time: int, step: int) -> list:
+    index = (open_time - TAPE_START) // TAPE_STEP
+    price = _price(index)
+    return [open_time, "%.2f" % price, "%.2f" % (price + 1), "%.2f" % (price - 1), "%.2f" % _price(index + 1),
+            "12.5", open_time + step - 1, "%.2f" % (12.5 * price), step // TAPE_STEP, "6.2", "%.2f" % (6.2 * price),
+            "0"]
+
+
+class _UnknownOrder(KeyError):
+    # answered with the exchange's "Order does not exist." code
+    pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockExchange"
+    disable_nagle_algorithm = True  # headers and body go out in separate writes, avoid the delayed ACK stall
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.exchange.handle(self)
+
+    def do_POST(self):
+        self.server.exchange.handle(self)
+
+    def do_DELETE(self):
+        self.server.exchange.handle(self)
+
+    def send(self, status: int, body, headers: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockExchange:
+    """
+    Threaded HTTP server answering the client's endpoints from memory. Orders placed through it are kept, so
+    query, cancel and all-orders calls see them.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 503, weight_limit: int = None, secret_key: str = None,
+                 seed: int = None):
+        """
+        :param host:
+        :param port: 0 picks a free port, see url
+        :param latency: seconds added to every answer
+        :param jitter: up to this many seconds added at random on top of latency
+        :param error_rate: fraction of requests answered with error_status
+        :param error_status: status of the injected errors
+        :param weight_limit: request weight per minute, 429 once spent; None never limits
+        :param secret_key: verify the signature of signed requests with this secret when sent
+        :param seed: seed of the latency and error randomness
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.weight_limit = weight_limit
+        self.secret_key = secret_key
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__window = None
+        self.__used_weight = 0
+        self.__orders = dict()
+        self.__order_ids = itertools.count(1)
+        self.__withdraw_ids = itertools.count(1)
+        self.requests = 0
+        self.__server = ThreadingHTTPServer((host, port), _Handler)
+        self.__server.daemon_threads = True
+        self.__server.exchange = self
+        self.__thread = None
+        self.depth_source = None  # a MockStream serving its books on the depth endpoint
+
+    @property
+    def url(self) -> str:
+        host, port = self.__server.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def start(self) -> str:
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="mock-exchange", daemon=True)
+        self.__thread.start()
+        return self.url
+
+    def serve_forever(self):
+        self.__server.serve_forever()
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def __spend(self, weight: int):
+        # weight used in the current minute after this request, None when over the limit
+        with self.__lock:
+            self.requests += 1
+            window = int(time.time() // 60)
+            if window != self.__window:
+                self.__window, self.__used_weight = window, 0
+            if self.weight_limit is not None and self.__used_weight + weight > self.weight_limit:
+                return None
+            self.__used_weight += weight
+            return self.__used_weight
+
+    def handle(self, request: _Handler):
+        split = urlsplit(request.path)
+        path, query = split.path, split.query
+        params = dict(parse_qsl(query))
+        weight = pytokocrypto.REQUEST_WEIGHTS.get((request.command, path), 1)
+        used = self.__spend(weight)
+        delay = self.latency + (self.__random.random() * self.jitter if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        if used is None:
+            retry_after = str(60 - int(time.time()) % 60)
+            return request.send(429, {"code": -1003, "msg": "Too many requests"}, {"Retry-After": retry_after})
+        headers = {pytokocrypto.USED_WEIGHT_HEADER: str(used)}
+        if self.error_rate and self.__random.random() < self.error_rate:
+            return request.send(self.error_status, {"code": -1001, "msg": "Internal error"}, headers)
+        if "signature" in params and self.secret_key is not None:
+            unsigned, _, signature = query.rpartition("&signature=")
+            expected = hmac.new(self.secret_key.encode(), unsigned.encode(), hashlib.sha256).hexdigest()
+            if not hmac.compare_digest(expected, signature):
+                return request.send(401, {"code": -1022, "msg": "Signature for this request is not valid."}, headers)
+        try:
+            status, body = self.answer(request.command, path, params)
+        except _UnknownOrder:
+            status, body = 400, {"code": pytokocrypto.ORDER_NOT_FOUND_CODE, "msg": "Order does not exist."}
+        except (KeyError, ValueError) as error:
+            status, body = 400, {"code": -1102, "msg": "Bad parameter %s" % error}
+        request.send(status, body, headers)
+
+    def answer(self, method: str, path: str, params: dict):
+        # (status, body) of one request
+        binance = path.startswith("/api/")
+        route = (method, path.rsplit("/", 1)[-1] if binance else path)
+        handler = self.__routes.get(route)
+        if handler is None:
+            return 404, {"code": -1, "msg": "Unknown endpoint %s %s" % (method, path)}
+        data = handler(self, params)
+        if binance:
+            return 200, data
+        return 200, {"code": 0, "msg": "Success", "data": data, "timestamp": int(time.time() * 1000)}
+
+    # general
+
+    def __symbols(self, params: dict):
+        return {"list": [{"symbol": symbol, "type": type_, "baseAsset": symbol.split("_")[0],
+                          "quoteAsset": symbol.split("_")[1], "spotTradingEnable": 1}
+                         for symbol, type_ in SYMBOLS.items()]}
+
+    def __time(self, params: dict):
+        return None
+
+    # market
+
+    def __depth(self, params: dict):
+        limit = int(params.get("limit") or 100)
+        if self.depth_source is not None:
+            return self.depth_source.snapshot(params["symbol"], limit)
+        mid = _price(int(time.time()))
+        return {"lastUpdateId": int(time.time() * 1000),
+                "bids": [["%.2f" % (mid - 0.01 * (i + 1)), "%.4f" % (1 + i % 7)] for i in range(limit)],
+                "asks": [["%.2f" % (mid + 0.01 * (i + 1)), "%.4f" % (1 + i % 5)] for i in range(limit)]}
+
+    @staticmethod
+    def __tape_range(params: dict, limit: int) -> range:
+        last = (int(time.time() * 1000) - TAPE_START) // TAPE_STEP
+        if params.get("fromId") is not None:
+            first = int(params["fromId"])
+        elif params.get("startTime") is not None:
+            first = -(-(int(params["startTime"]) - TAPE_START) // TAPE_STEP)
+            if params.get("endTime") is not None:
+                last = min(last, (int(params["endTime"]) - TAPE_START) // TAPE_STEP)
+        else:
+            first = last - limit + 1
+        first = max(first, 0)
+        return range(first, max(first, min(last + 1, first + limit)))
+
+    def __trades(self, params: dict):
+        return [_trade(index) for index in self.__tape_range(params, int(params.get("limit") or 500))]
+
+    def __agg_trades(self, params: dict):
+        return [_agg_trade(index) for index in self.__tape_range(params, int(params.get("limit") or 500))]
+
+    def __klines(self, params: dict):
+        step = KLINE_INTERVALS[params["interval"]]
+        limit = int(params.get("limit") or 500)
+        now = int(time.time() * 1000) // step * step
+        end = min(int(params["endTime"]), now) if params.get("endTime") is not None else now
+        if params.get("startTime") is not None:
+            start = -(-int(params["startTime"]) // step) * step
+        else:
+            start = end - (limit - 1) * step
+        return [_kline(open_time, step) for open_time in range(start, end + 1, step)[:limit]]
+
+    # account
+
+    def __new_order(self, params: dict):
+        order_id = next(self.__order_ids)
+        order = {"orderId": order_id, "clientId": params.get("clientId") or "mock-%d" % order_id,
+                 "symbol": params["symbol"], "side": int(params["side"]), "type": int(params["type"]),
+                 "price": params.get("price", "0"), "origQty": params.get("quantity", "0"), "executedQty": "0",
+                 "stopPrice": params.get("stopPrice", "0"), "status": 0,
+                 "timeInForce": int(params.get("timeInForce") or 1), "createTime": int(time.time() * 1000)}
+        with self.__lock:
+            self.__orders[order_id] = order
+        return order
+
+    def __query_order(self, params: dict):
+        with self.__lock:
+            if "orderId" in params:
+                order_id = int(params["orderId"])
+                if order_id not in self.__orders:
+                    raise _UnknownOrder(order_id)
+                return self.__orders[order_id]
+            # by clientId, the way Resilience looks up a new order whose answer was lost
+            for order in self.__orders.values():
+                if order["clientId"] == params["clientId"]:
+                    return order
+            raise _UnknownOrder(params["clientId"])
+
+    def __cancel_order(self, params: dict):
+        with self.__lock:
+            order = self.__orders[int(params["orderId"])]
+            order["status"] = 3
+            return order
+
+    def __orders_or_trades(self, params: dict):
+        # all orders and the trade list share one path, the trade list sends asset instead of symbol
+        if "symbol" not in params:
+            return {"list": [{"tradeId": index, "orderId": index, "symbol": params.get("asset"),
+                              "price": "%.2f" % _price(index), "qty": "0.5", "commission": "0.001",
+                              "commissionAsset": "BNB", "isBuyer": index % 2 == 0, "isMaker": index % 3 == 0,
+                              "time": TAPE_START + index * TAPE_STEP}
+                             for index in range(int(params.get("limit") or 500))]}
+        limit = int(params.get("limit") or 500)
+        from_id = int(params["fromId"]) if params.get("fromId") else 0
+        start_time = int(params.get("startTime") or 0)
+        with self.__lock:
+            rows = [order for order_id, order in self.__orders.items()
+                    if order["symbol"] == params["symbol"] and order_id >= from_id and order["createTime"] >= start_time]
+        return {"list": rows[:limit]}
+
+    def __new_oco(self, params: dict):
+        legs = [self.__new_order({**params, "type": 2}), self.__new_order({**params, "type": 3})]
+        return {"orderListId": legs[0]["orderId"], "orderReports": legs}
+
+    def __account(self, params: dict):
+        return {"makerCommission": 10, "takerCommission": 10, "canTrade": 1,
+                "accountAssets": [self.__asset({"asset": asset}) for asset in ASSETS]}
+
+    def __asset(self, params: dict):
+        return {"asset": params["asset"], "free": "1000.00000000", "locked": "0.00000000"}
+
+    # wallet
+
+    def __withdraw(self, params: dict):
+        return {"withdrawId": next(self.__withdraw_ids)}
+
+    def __withdraw_history(self, params: dict):
+        return {"list": [{"id": "w%d" % index, "clientId": None, "asset": params.get("asset") or "USDT",
+                          "network": "BSC", "address": "0xmock", "addressTag": "", "amount": "10", "fee": "0.5",
+                          "txId": "0x%064x" % index, "status": 6, "applyTime": TAPE_START + index * 60000}
+                         for index in range(50)]}
+
+    def __deposit_history(self, params: dict):
+        return {"list": [{"id": index, "asset": params.get("asset") or "USDT", "network": "BSC",
+                          "address": "0xmock", "addressTag": "", "txId": "0x%064x" % index, "amount": "25",
+                          "status": 1, "insertTime": TAPE_START + index * 60000}
+                         for index in range(50)]}
+
+    def __deposit_address(self, params: dict):
+        return {"asset": params["asset"], "network": params.get("network"), "address": "0xmock", "addressTag": ""}
+
+    __routes = {
+        ("GET", pytokocrypto.GENERAL_SUPPORTED_TRADING_SYMBOL_URL): __symbols,
+        ("GET", pytokocrypto.GENERAL_CHECK_SERVER_TIME_URL): __time,
+        ("GET", pytokocrypto.MARKET_ORDER_BOOK_URL): __depth,
+        ("GET", "depth"): __depth,
+        ("GET", pytokocrypto.MARKET_RECENT_TRADES_LIST_URL): __trades,
+        ("GET", "trades"): __trades,
+        ("GET", pytokocrypto.MARKET_AGGREGATE_TRADE_LIST_URL): __agg_trades,
+        ("GET", "aggTrades"): __agg_trades,
+        ("GET", pytokocrypto.MARKET_CANDLESTICK_DATA_URL): __klines,
+        ("GET", "klines"): __klines,
+        ("POST", pytokocrypto.ACCOUNT_NEW_ORDER_URL): __new_order,
+        ("GET", pytokocrypto.ACCOUNT_QUERY_ORDER_URL): __query_order,
+        ("POST", pytokocrypto.ACCOUNT_CANCEL_ORDER_URL): __cancel_order,
+        ("GET", pytokocrypto.ACCOUNT_ALL_ORDER): __orders_or_trades,
+        ("POST", pytokocrypto.ACCOUNT_NEW_OCO): __new_oco,
+        ("GET", pytokocrypto.ACCOUNT_INFORMATION_URL): __account,
+        ("GET", pytokocrypto.ACCOUNT_ASSET_INFORMATION_URL): __asset,
+        ("POST", pytokocrypto.WALLET_WITHDRAW_URL): __withdraw,
+        ("GET", pytokocrypto.WALLET_WITHDRAW_HISTORY_URL): __withdraw_history,
+        ("GET", pytokocrypto.WALLET_DEPOSIT_HISTORY_URL): __deposit_history,
+        ("GET", pytokocrypto.WALLET_DEPOSIT_ADDRESS_URL): __deposit_address
+    }
+
+
+class MockStream:
+    """
+    Combined-stream WebSocket host (/stream?streams=a/b, SUBSCRIBE messages). Every interval it changes one bid and
+    one ask level of each subscribed symbol's book and sends the diff with consecutive U/u update ids, plus a trade
+    and a kline update on the symbol's trade and kline streams. Attached to a MockExchange, the exchange's depth
+    endpoint answers from the same books, so depth resyncs line up with the diffs.
+    Runs its own event loop thread.
+    """
+    def __init__(self, exchange: MockExchange = None, host: str = "127.0.0.1", port: int = 0,
+                 interval: float = 0.01, levels: int = 50, drop_after: int = None, seed: int = None):
+        """
+        :param exchange: MockExchange whose depth endpoint serves this stream's books
+        :param host:
+        :param port: 0 picks a free port, see url
+        :param interval: seconds between updates
+        :param levels: price levels per book side
+        :param drop_after: close every connection after sending this many messages, to exercise reconnects
+        :param seed: seed of the book changes
+        """
+        if websockets is None:
+            raise ImportError("MockStream requires websockets, install it with `pip install websockets`")
+        self.interval = interval
+        self.levels = levels
+        self.drop_after = drop_after
+        self.paused = False
+        self.messages = 0
+        self.connections = 0
+        self.__host = host
+        self.__port = port
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__books = dict()
+        self.__clients = dict()
+        self.__trade_ids = itertools.count(1)
+        self.__loop = None
+        self.__stopped = None
+        self.__started = threading.Event()
+        self.__thread = None
+        if exchange is not None:
+            exchange.depth_source = self
+
+    @property
+    def url(self) -> str:
+        return "ws://%s:%d/stream" % (self.__host, self.__port)
+
+    def start(self) -> str:
+        self.__thread = threading.Thread(target=asyncio.run, args=(self.__main(),), name="mock-stream", daemon=True)
+        self.__thread.start()
+        self.__started.wait()
+        return self.url
+
+    def stop(self):
+        self.__loop.call_soon_threadsafe(self.__stopped.set)
+        self.__thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def __book(self, key: str) -> list:
+        # caller holds the lock; [last update id, {price: qty} bids, {price: qty} asks]
+        book = self.__books.get(key)
+        if book is None:
+            book = self.__books[key] = [1, {"%.2f" % (100 - 0.01 * (i + 1)): "%.4f" % (1 + i % 7)
+                                            for i in range(self.levels)},
+                                        {"%.2f" % (100 + 0.01 * (i + 1)): "%.4f" % (1 + i % 5)
+                                         for i in range(self.levels)}]
+        return book
+
+    def snapshot(self, symbol: str, limit: int) -> dict:
+        # depth answer of symbol (REST market symbol) consistent with the diffs sent so far
+        with self.__lock:
+            update_id, bids, asks = self.__book(symbol.replace("_", "").lower())
+            return {"lastUpdateId": update_id,
+                    "bids": sorted(([price, qty] for price, qty in bids.items()), key=lambda level: -float(level[0]))
+                    [:limit],
+                    "asks": sorted(([price, qty] for price, qty in asks.items()), key=lambda level: float(level[0]))
+                    [:limit]}
+
+    def __diff(self, key: str) -> dict:
+        with self.__lock:
+            book = self.__book(key)
+            book[0] += 1
+            changes = []
+            for side, sign in ((book[1], -1), (book[2], 1)):
+                price = "%.2f" % (100 + sign * 0.01 * self.__random.randint(1, self.levels))
+                qty = "0.0000" if price in side and self.__random.random() < 0.3 else \
+                    "%.4f" % self.__random.uniform(0.1, 5)
+                if qty == "0.0000":
+                    side.pop(price, None)
+                else:
+                    side[price] = qty
+                changes.append([[price, qty]])
+            return {"e": "depthUpdate", "E": int(time.time() * 1000), "s": key.upper(), "U": book[0], "u": book[0],
+                    "b": changes[0], "a": changes[1]}
+
+    async def __main(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__stopped = asyncio.Event()
+        async with websockets.serve(self.__serve, self.__host, self.__port) as server:
+            self.__port = server.sockets[0].getsockname()[1]
+            self.__started.set()
+            ticker = asyncio.ensure_future(self.__tick())
+            await self.__stopped.wait()
+            ticker.cancel()
+
+    async def __serve(self, websocket):
+        request = getattr(websocket, "request", None)
+        path = request.path if request is not None else getattr(websocket, "path", "")
+        streams = parse_qs(urlsplit(path).query).get("streams", [""])[0]
+        self.__clients[websocket] = [set(name for name in streams.split("/") if name), 0]
+        self.connections += 1
+        try:
+            async for message in websocket:
+                message = json.loads(message)
+                if message.get("method") == "SUBSCRIBE":
+                    self.__clients[websocket][0].update(message.get("params", []))
+                elif message.get("method") == "UNSUBSCRIBE":
+                    self.__clients[websocket][0].difference_update(message.get("params", []))
+                await websocket.send(json.dumps({"result": None, "id": message.get("id")}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.__clients.pop(websocket, None)
+
+    async def __tick(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.paused:
+                continue
+            names = set()
+            for subscribed, _ in list(self.__clients.values()):
+                names |= subscribed
+            now = int(time.time() * 1000)
+            data = dict()
+            for key in {name.split("@", 1)[0] for name in names}:
+                data[key + "@depth"] = self.__diff(key)
+                index = next(self.__trade_ids)
+                data[key + "@trade"] = {"e": "trade", "E": now, "s": key.upper(), "t": index,
+                                        "p": "%.2f" % _price(index), "q": "0.5000", "T": now, "m": index % 2 == 0}
+                data[key + "@kline"] = {"e": "kline", "E": now, "s": key.upper(),
+                                        "k": {"t": now // 60000 * 60000, "o": "100.00", "c": "%.2f" % _price(index),
+                                              "h": "101.00", "l": "99.00", "v": "12.5", "x": False}}
+            for websocket, client in list(self.__clients.items()):
+                for name in client[0]:
+                    key, _, channel = name.partition("@")
+                    payload = data.get(key + "@" + channel.split("@", 1)[0].split("_", 1)[0])
+                    if payload is None:
+                        continue
+                    try:
+                        await websocket.send(json.dumps({"stream": name, "data": payload}))
+                    except websockets.ConnectionClosed:
+                        break
+                    self.messages += 1
+                    client[1] += 1
+                    if self.drop_after is not None and client[1] >= self.drop_after:
+                        await websocket.close()
+                        break
+
+
+@contextmanager
+def use_mock(url: str):
+    # Point pytokocrypto's Tokocrypto and Binance REST urls at url for the duration of the block.
+    names = ["BASE_URL"] + [name for name in vars(pytokocrypto)
+                            if name.endswith("_BINANCE_URL") and name != "STREAM_BINANCE_URL"]
+    saved = {name: getattr(pytokocrypto, name) for name in names}
+    pytokocrypto.BASE_URL = url
+    for name in names[1:]:
+        setattr(pytokocrypto, name, url + urlsplit(saved[name]).path)
+    try:
+        yield url
+    finally:
+        for name, value in saved.items():
+            setattr(pytokocrypto, name, value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000, help="0 picks a free port")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra seconds, up to this much")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--weight-limit", type=int, default=None, help="request weight per minute")
+    parser.add_argument("--secret-key", default=None, help="verify signatures with this secret")
+    args = parser.parse_args()
+    exchange = MockExchange(args.host, args.port, args.latency, args.jitter, args.error_rate, args.error_status,
+                            args.weight_limit, args.secret_key)
+    print(exchange.url, flush=True)
+    try:
+        exchange.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
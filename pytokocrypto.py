@@ -1,12 +1,49 @@
 # Copyright 2023 - Ikhsan Maulana
 
+import asyncio
+import bisect
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError
 import time
 import hmac
 import hashlib
+import heapq
+import itertools
 import json
-from urllib.parse import urlencode
-from datetime import datetime
+import os
+import random
+import uuid
+from collections import OrderedDict
+import threading
+from urllib.parse import quote_plus, urlsplit
+from array import array
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed as futures_as_completed, wait as futures_wait, \
+    FIRST_COMPLETED, TimeoutError as FuturesTimeoutError
+
+try:
+    import aiohttp
+    from yarl import URL
+except ImportError:  # AsyncTokoCrypto needs aiohttp, the blocking client does not
+    aiohttp = None
+
+try:
+    import websockets
+except ImportError:  # only MarketStream needs websockets
+    websockets = None
+
+try:
+    import numpy as np
+except ImportError:  # only the columnar (as_array) output needs numpy
+    np = None
+
+try:
+    import orjson
+except ImportError:  # optional faster json decoding
+    orjson = None
+
+_loads = orjson.loads if orjson is not None else json.loads
 
 BASE_URL = "https://www.tokocrypto.com"
 GENERAL_CHECK_SERVER_TIME_URL = "/open/v1/common/time"
@@ -35,87 +72,1800 @@ WALLET_WITHDRAW_HISTORY_URL = "/open/v1/withdraws"
 WALLET_DEPOSIT_HISTORY_URL = "/open/v1/deposits"
 WALLET_DEPOSIT_ADDRESS_URL = "/open/v1/deposits/address"
 
+STREAM_URL = "wss://stream-cloud.tokocrypto.com/stream"
+STREAM_BINANCE_URL = "wss://stream.binance.com:9443/stream"
+
+# url paths of the public market endpoints on both hosts, by method name
+MARKET_ENDPOINT_PATHS = {
+    "market_order_book": (MARKET_ORDER_BOOK_URL, urlsplit(MARKET_ORDER_BOOK_BINANCE_URL).path),
+    "market_recent_trades_list": (MARKET_RECENT_TRADES_LIST_URL, urlsplit(MARKET_RECENT_TRADES_LIST_BINANCE_URL).path),
+    "market_aggregate_trade_list": (MARKET_AGGREGATE_TRADE_LIST_URL,
+                                    urlsplit(MARKET_AGGREGATE_TRADE_LIST_BINANCE_URL).path),
+    "market_candlestick_data": (MARKET_CANDLESTICK_DATA_URL, urlsplit(MARKET_CANDLESTICK_DATA_BINANCE_URL).path)
+}
+MARKET_BATCH_METHODS = ("market_order_book", "market_recent_trades_list", "market_aggregate_trade_list",
+                        "market_candlestick_data")
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_ASYNC_POOL_LIMIT = 100
+DEFAULT_FANOUT_WORKERS = DEFAULT_POOL_MAXSIZE
+
+SYMBOL_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "pytokocrypto", "symbols.json")
+SYMBOL_CACHE_TTL = 3600
+SYMBOL_MIN_REFRESH_INTERVAL = 10
+
+# seconds a public market answer may be reused by ResponseCache
+DEFAULT_CACHE_TTLS = {
+    "market_order_book": 0.25,
+    "market_recent_trades_list": 0.5,
+    "market_aggregate_trade_list": 1,
+    "market_candlestick_data": 1
+}
+DEFAULT_CACHE_MAX_ENTRIES = 1024
+
+# upper bounds in seconds of the Metrics latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Resilience defaults
+RETRIES = 2
+RETRY_BACKOFF = 0.1
+RETRY_MAX_BACKOFF = 2
+HEDGE_DELAY = 0.5
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 10
+# payload fields a request that may have been executed can be looked up by
+CLIENT_ID_FIELDS = ("clientId", "listClientId")
+# error code of the exchange's "Order does not exist." answer
+ORDER_NOT_FOUND_CODE = -2013
+
+# MarketStream defaults
+STREAM_MAX_PER_CONNECTION = 200
+STREAM_RECONNECT_DELAY = 0.5
+STREAM_MAX_RECONNECT_DELAY = 30
+STREAM_QUEUE_SIZE = 10000
+
+# AccountState
+ACCOUNT_RECONCILE_INTERVAL = 30
+# seconds the orders walk of a reconcile reaches back before its lower bound, for clock skew and orders in flight
+ACCOUNT_RECONCILE_OVERLAP = 60
+SIDE_BUY = 0
+SIDE_SELL = 1
+OPEN_ORDER_STATUSES = (0, 1, "NEW", "PARTIALLY_FILLED")
+CLOSED_ORDER_STATUSES = (2, 3, 5, 6, "FILLED", "CANCELED", "REJECTED", "EXPIRED")
+
+CLOCK_SYNC_INTERVAL = 60
+CLOCK_SYNC_SAMPLES = 5
+CLOCK_SYNC_SMOOTHING = 0.3
+
+KLINE_STORE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "pytokocrypto", "klines")
+INTERVAL_MILLISECONDS = {
+    "1m": 60000, "3m": 180000, "5m": 300000, "15m": 900000, "30m": 1800000,
+    "1h": 3600000, "2h": 7200000, "4h": 14400000, "6h": 21600000, "8h": 28800000, "12h": 43200000,
+    "1d": 86400000, "3d": 259200000, "1w": 604800000
+}
+
+AGG_TRADE_STORE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "pytokocrypto", "aggtrades")
+AGG_TRADE_SHARD = 86400000
+AGG_TRADE_WINDOW = 3600000  # widest startTime/endTime window the aggTrades endpoint accepts
+AGG_TRADE_PAGE_SIZE = 1000
+
+# symbol routing: market data of type 1 symbols is served by Binance, everything else by Tokocrypto
+ROUTE_TOKOCRYPTO = 0
+ROUTE_BINANCE = 1
+
+# request weight budget per host and minute, paced by WeightScheduler
+WEIGHT_WINDOW = 60
+DEFAULT_WEIGHT_LIMIT = 1200
+DEFAULT_WEIGHT_LIMITS = {
+    "www.tokocrypto.com": 1200,
+    "api.binance.com": 6000
+}
+WEIGHT_HEADROOM = 0.9
+USED_WEIGHT_HEADER = "X-MBX-USED-WEIGHT-1M"
+
+# scheduling priority, lower goes first
+PRIORITY_ORDER = 0
+PRIORITY_ACCOUNT = 1
+PRIORITY_MARKET = 2
+
+# (method, path) of endpoints that do not weigh 1
+REQUEST_WEIGHTS = {
+    ("GET", "/api/v3/depth"): 5,
+    ("GET", "/api/v3/trades"): 25,
+    ("GET", "/api/v3/aggTrades"): 4,
+    ("GET", "/api/v1/klines"): 2,
+    ("GET", ACCOUNT_ALL_ORDER): 5,
+    ("GET", ACCOUNT_INFORMATION_URL): 5
+}
+REQUEST_PRIORITIES = {
+    ("POST", ACCOUNT_NEW_ORDER_URL): PRIORITY_ORDER,
+    ("POST", ACCOUNT_CANCEL_ORDER_URL): PRIORITY_ORDER,
+    ("POST", ACCOUNT_NEW_OCO): PRIORITY_ORDER
+}
+
+
+def create_session(pool_connections: int = DEFAULT_POOL_CONNECTIONS, pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+                   pool_block: bool = False) -> requests.Session:
+    """
+    Build a keep-alive HTTP session that can be shared between several clients.
+    :param pool_connections: number of per-host connection pools to keep (tokocrypto.com, api.binance.com, ...)
+    :param pool_maxsize: maximum number of connections kept alive per host
+    :param pool_block: block when a host's pool is exhausted instead of opening a throw-away connection
+    :return: requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class _Signer:
+    # HMAC SHA256 keyed once with the secret key, every signature starts from a copy of that state
+    __slots__ = ("__hmac",)
+
+    def __init__(self, secret_key: str):
+        self.__hmac = hmac.new(secret_key.encode("utf-8"), digestmod=hashlib.sha256)
+
+    def sign(self, query_string: str) -> str:
+        m = self.__hmac.copy()
+        m.update(query_string.encode("utf-8"))
+        return m.hexdigest()
+
+
+def _encode_query(payload: dict) -> str:
+    # Same output as urlencode(), skipping None fields without building a filtered dict first.
+    parts = []
+    for key, value in payload.items():
+        if value is None:
+            continue
+        if value.__class__ is int:
+            parts.append(key + "=" + str(value))
+        else:
+            parts.append(key + "=" + quote_plus(str(value)))
+    return "&".join(parts)
+
+
+class _RequestPlan:
+    # Compiled endpoint template; the query string is built once per call and the same bytes are signed and sent.
+    __slots__ = ("method", "endpoint_url", "signed", "url_prefix", "host", "path", "weight", "priority")
+
+    def __init__(self, method: str, endpoint_url: str, signed: bool):
+        self.method = method.upper()
+        self.endpoint_url = endpoint_url
+        self.signed = signed
+        self.url_prefix = endpoint_url + "?"
+        url = urlsplit(endpoint_url)
+        self.host = url.netloc
+        self.path = url.path
+        self.weight = REQUEST_WEIGHTS.get((self.method, url.path), 1)
+        self.priority = REQUEST_PRIORITIES.get((self.method, url.path), PRIORITY_ACCOUNT if signed else PRIORITY_MARKET)
+
+    def prepare(self, payload: dict, signer: _Signer = None) -> str:
+        query_string = _encode_query(payload)
+        if self.signed:
+            if signer is None:
+                raise ValueError("secret_key is required to call a signed endpoint")
+            signature = signer.sign(query_string)
+            query_string = query_string + "&signature=" + signature if query_string else "signature=" + signature
+        return self.url_prefix + query_string if query_string else self.endpoint_url
+
+
+_REQUEST_PLANS = dict()
+
+
+def _get_plan(method: str, endpoint_url: str, signed: bool) -> _RequestPlan:
+    key = (method, endpoint_url, signed)
+    plan = _REQUEST_PLANS.get(key)
+    if plan is None:
+        plan = _REQUEST_PLANS[key] = _RequestPlan(method, endpoint_url, signed)
+    return plan
+
+
+class _HostBudget:
+    __slots__ = ("limit", "used", "window", "blocked_until", "waiters")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.window = 0
+        self.blocked_until = 0.0
+        self.waiters = []
+
+
+class WeightScheduler:
+    """
+    Client-side request weight budget. Tracks the weight used per host in the exchange's one-minute windows
+    (trusting the used-weight response header when present), holds requests back once the budget is spent and
+    releases waiting requests by priority, so order entry and cancels go before market data polling.
+    A 429 or 418 answer pauses the host for its Retry-After. One scheduler can be shared by many clients.
+    """
+    def __init__(self, limits: dict = None, window: int = WEIGHT_WINDOW, headroom: float = WEIGHT_HEADROOM):
+        """
+        :param limits: weight per window by host, merged over DEFAULT_WEIGHT_LIMITS
+        :param window: window length in seconds
+        :param headroom: fraction of the limit this process may spend
+        """
+        self.__limits = {**DEFAULT_WEIGHT_LIMITS, **(limits or {})}
+        self.__window = window
+        self.__headroom = headroom
+        self.__condition = threading.Condition()
+        self.__hosts = dict()
+        self.__sequence = itertools.count()
+
+    def __budget(self, host: str) -> _HostBudget:
+        # caller holds the condition lock
+        budget = self.__hosts.get(host)
+        if budget is None:
+            limit = max(1, int(self.__limits.get(host, DEFAULT_WEIGHT_LIMIT) * self.__headroom))
+            budget = self.__hosts[host] = _HostBudget(limit)
+        window = int(time.time() // self.__window)
+        if window != budget.window:
+            budget.window = window
+            budget.used = 0
+        return budget
+
+    def acquire(self, host: str, weight: int = 1, priority: int = PRIORITY_MARKET):
+        # Block until the request fits in the host's budget and no higher priority request is waiting.
+        with self.__condition:
+            budget = self.__budget(host)
+            weight = min(weight, budget.limit)
+            ticket = (priority, next(self.__sequence))
+            heapq.heappush(budget.waiters, ticket)
+            try:
+                while True:
+                    budget = self.__budget(host)
+                    timeout = None
+                    if budget.waiters[0] == ticket:
+                        now = time.time()
+                        if now < budget.blocked_until:
+                            timeout = budget.blocked_until - now
+                        elif budget.used + weight > budget.limit:
+                            timeout = (budget.window + 1) * self.__window - now
+                        else:
+                            budget.used += weight
+                            return
+                    self.__condition.wait(timeout)
+            finally:
+                budget.waiters.remove(ticket)
+                heapq.heapify(budget.waiters)
+                self.__condition.notify_all()
+
+    def observe(self, host: str, response):
+        # Sync the budget with the exchange's answer: used-weight header and 429/418 back-off.
+        used = response.headers.get(USED_WEIGHT_HEADER)
+        with self.__condition:
+            budget = self.__budget(host)
+            if used is not None:
+                budget.used = max(budget.used, int(used))
+            if response.status_code in (418, 429):
+                retry_after = response.headers.get("Retry-After")
+                retry_after = float(retry_after) if retry_after else self.__window
+                budget.blocked_until = max(budget.blocked_until, time.time() + retry_after)
+            self.__condition.notify_all()
+
+    def budget(self) -> dict:
+        # Current budget per host for monitoring.
+        with self.__condition:
+            now = time.time()
+            snapshot = dict()
+            for host in self.__hosts:
+                budget = self.__budget(host)
+                snapshot[host] = {
+                    "limit": budget.limit,
+                    "used": budget.used,
+                    "remaining": max(0, budget.limit - budget.used),
+                    "waiting": len(budget.waiters),
+                    "blocked_for": max(0.0, budget.blocked_until - now)
+                }
+            return snapshot
+
+
+class ClockSync:
+    """
+    Exchange clock estimate for signed request timestamps. A daemon thread samples the server time every interval
+    seconds, keeps the lowest round-trip sample of each burst, compensates half its RTT and smooths the offset.
+    timestamp() only reads memory: it starts from a monotonic clock, adds the offset and never goes backwards.
+    The sampling thread starts on the first timestamp() call. One clock can be shared by many clients.
+    """
+    def __init__(self, fetch_server_time=None, interval: float = CLOCK_SYNC_INTERVAL, samples: int = CLOCK_SYNC_SAMPLES,
+                 smoothing: float = CLOCK_SYNC_SMOOTHING, session: requests.Session = None, timeout=DEFAULT_TIMEOUT):
+        """
+        :param fetch_server_time: callable returning the server time in milliseconds, defaults to the
+        general_check_server_time endpoint
+        :param interval: seconds between sampling bursts
+        :param samples: requests per burst, the one with the lowest RTT is kept
+        :param smoothing: weight of a new burst in the offset's moving average, 1 keeps only the latest
+        :param session: session used by the default fetch
+        :param timeout: timeout of the default fetch
+        """
+        self.__fetch_server_time = fetch_server_time or self.__fetch_default
+        self.__interval = interval
+        self.__samples = samples
+        self.__smoothing = smoothing
+        self.__session = session
+        self.__timeout = timeout
+        self.__wall_anchor = time.time() * 1000
+        self.__monotonic_anchor = time.monotonic()
+        self.__offset = None
+        self.__rtt = None
+        self.__last = 0
+        self.__thread = None
+        self.__stop = threading.Event()
+        self.last_error = None
+
+    def __fetch_default(self) -> int:
+        response = (self.__session or requests).get(BASE_URL + GENERAL_CHECK_SERVER_TIME_URL, timeout=self.__timeout)
+        response.raise_for_status()
+        return int(response.json()["timestamp"])
+
+    def __local(self) -> float:
+        return self.__wall_anchor + (time.monotonic() - self.__monotonic_anchor) * 1000
+
+    def sample(self):
+        # Take one burst now and fold it into the offset.
+        best = None
+        for _ in range(self.__samples):
+            sent = self.__local()
+            server_time = self.__fetch_server_time()
+            received = self.__local()
+            rtt = received - sent
+            if best is None or rtt < best[0]:
+                best = (rtt, server_time - (sent + received) / 2)
+        rtt, offset = best
+        if self.__offset is None:
+            self.__offset = offset
+        else:
+            self.__offset += self.__smoothing * (offset - self.__offset)
+        self.__rtt = rtt
+
+    def __run(self):
+        while not self.__stop.is_set():
+            try:
+                self.sample()
+                self.last_error = None
+            except Exception as error:
+                self.last_error = error
+            self.__stop.wait(self.__interval)
+
+    def start(self):
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run, name="pytokocrypto-clock", daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+
+    def timestamp(self) -> int:
+        # Corrected exchange time in milliseconds, the local clock until the first sample lands.
+        if self.__thread is None:
+            self.start()
+        timestamp = int(self.__local() + (self.__offset or 0.0))
+        if timestamp < self.__last:
+            timestamp = self.__last
+        self.__last = timestamp
+        return timestamp
 
-class BaseTokoCrypto:
-    def __init__(self, api_key: str = None, secret_key: str = None):
-        self.__api_key = api_key
-        self.__secret_key = secret_key
-        self.__headers = {"X-MBX-APIKEY": self.__api_key}
-        self.__symbol_type = self.__get_symbol_type()
+    @property
+    def offset(self) -> float:
+        # server minus local milliseconds, None before the first sample
+        return self.__offset
+
+    @property
+    def rtt(self) -> float:
+        return self.__rtt
+
+
+class _Flight:
+    # one request on the wire that identical concurrent requests wait for
+    __slots__ = ("done", "response", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class ResponseCache:
+    """
+    Opt-in cache for the unsigned market endpoints. Answers are reused for a per-endpoint TTL, memory is bounded by
+    LRU eviction, and identical requests made while one is on the wire wait for it instead of sending their own.
+    One cache can be shared by many clients.
+    """
+    def __init__(self, ttls: dict = None, max_entries: int = DEFAULT_CACHE_MAX_ENTRIES):
+        """
+        :param ttls: seconds per market method name, merged over DEFAULT_CACHE_TTLS; 0 or None disables an endpoint
+        :param max_entries: answers kept before the least recently used is evicted
+        """
+        self.__ttls = dict()
+        for method, ttl in {**DEFAULT_CACHE_TTLS, **(ttls or {})}.items():
+            for path in MARKET_ENDPOINT_PATHS[method]:
+                self.__ttls[path] = ttl
+        self.__max_entries = max_entries
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()
+        self.__flights = dict()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def ttl(self, path: str):
+        return self.__ttls.get(path)
+
+    def get_or_fetch(self, key: str, ttl: float, fetch):
+        # Cached answer for key, else the answer of the request already in flight, else fetch() once.
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.__entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.__entries[key]
+            flight = self.__flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = self.__flights[key] = _Flight()
+                self.misses += 1
+                leader = True
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.response
+        try:
+            flight.response = fetch()
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self.__lock:
+                del self.__flights[key]
+                if flight.error is None:
+                    self.__entries[key] = (time.monotonic() + ttl, flight.response)
+                    self.__entries.move_to_end(key)
+                    while len(self.__entries) > self.__max_entries:
+                        self.__entries.popitem(last=False)
+                        self.evictions += 1
+            flight.done.set()
+        return flight.response
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return {
+                "entries": len(self.__entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions
+            }
+
+
+class Metrics:
+    """
+    Request instrumentation for BaseTokoCrypto: latency histograms per (phase, endpoint path, host), status code,
+    error and retry counters, and pre/post request hooks. Phases are "sign" (query string and signature),
+    "queue" (WeightScheduler wait), "http" (request sent to headers received, including connect), "total" and
+    "decode" (json of the responses the client decodes itself).
+    A client without metrics does not measure anything.
+    """
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.__buckets = tuple(buckets)
+        self.__lock = threading.Lock()
+        self.__histograms = dict()
+        self.__statuses = dict()
+        self.__errors = dict()
+        self.__retries = dict()
+        self.pre_hooks = []
+        self.post_hooks = []
+
+    def add_pre_hook(self, hook):
+        # hook(method, url) called before a request is queued
+        self.pre_hooks.append(hook)
+
+    def add_post_hook(self, hook):
+        # hook(method, url, response, error, seconds) called once a request is answered or failed
+        self.post_hooks.append(hook)
+
+    def observe(self, phase: str, endpoint: str, host: str, seconds: float):
+        key = (phase, endpoint, host)
+        index = bisect.bisect_left(self.__buckets, seconds)
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = [[0] * (len(self.__buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def count_status(self, endpoint: str, host: str, status: int):
+        self.__count(self.__statuses, (endpoint, host, status))
+
+    def count_error(self, endpoint: str, host: str, error: Exception):
+        self.__count(self.__errors, (endpoint, host, error.__class__.__name__))
+
+    def count_retry(self, endpoint: str, host: str):
+        self.__count(self.__retries, (endpoint, host))
+
+    def __count(self, counters: dict, key: tuple):
+        with self.__lock:
+            counters[key] = counters.get(key, 0) + 1
+
+    def before(self, method: str, url: str):
+        for hook in self.pre_hooks:
+            hook(method, url)
+
+    def after(self, plan: _RequestPlan, url: str, response, error: Exception, seconds: float):
+        self.observe("total", plan.path, plan.host, seconds)
+        if response is not None:
+            self.observe("http", plan.path, plan.host, response.elapsed.total_seconds())
+            self.count_status(plan.path, plan.host, response.status_code)
+        if error is not None:
+            self.count_error(plan.path, plan.host, error)
+        for hook in self.post_hooks:
+            hook(plan.method, url, response, error, seconds)
+
+    def percentile(self, phase: str, endpoint: str, host: str, q: float):
+        # Upper bucket bound holding the q quantile (0..1), None without samples.
+        with self.__lock:
+            histogram = self.__histograms.get((phase, endpoint, host))
+            if histogram is None or not histogram[2]:
+                return None
+            rank, seen = q * histogram[2], 0
+            for index, count in enumerate(histogram[0]):
+                seen += count
+                if seen >= rank and count:
+                    return self.__buckets[index] if index < len(self.__buckets) else float("inf")
+        return None
+
+    def snapshot(self) -> dict:
+        with self.__lock:
+            return {
+                "buckets": self.__buckets,
+                "latency": {key: {"counts": list(histogram[0]), "sum": histogram[1], "count": histogram[2]}
+                            for key, histogram in self.__histograms.items()},
+                "statuses": dict(self.__statuses),
+                "errors": dict(self.__errors),
+                "retries": dict(self.__retries)
+            }
+
+    def to_prometheus(self, prefix: str = "pytokocrypto") -> str:
+        # Metrics in the Prometheus text exposition format.
+        snapshot = self.snapshot()
+        lines = ["# TYPE %s_request_seconds histogram" % prefix]
+        for (phase, endpoint, host), histogram in sorted(snapshot["latency"].items()):
+            labels = 'phase="%s",endpoint="%s",host="%s"' % (phase, endpoint, host)
+            cumulative = 0
+            for bound, count in zip(self.__buckets + ("+Inf",), histogram["counts"]):
+                cumulative += count
+                lines.append('%s_request_seconds_bucket{%s,le="%s"} %d' % (prefix, labels, bound, cumulative))
+            lines.append("%s_request_seconds_sum{%s} %r" % (prefix, labels, histogram["sum"]))
+            lines.append("%s_request_seconds_count{%s} %d" % (prefix, labels, histogram["count"]))
+        for name, label, counters in (("responses", "status", snapshot["statuses"]),
+                                      ("errors", "error", snapshot["errors"])):
+            lines.append("# TYPE %s_%s_total counter" % (prefix, name))
+            for (endpoint, host, value), count in sorted(counters.items()):
+                lines.append('%s_%s_total{endpoint="%s",host="%s",%s="%s"} %d' % (prefix, name, endpoint, host,
+                                                                                   label, value, count))
+        lines.append("# TYPE %s_retries_total counter" % prefix)
+        for (endpoint, host), count in sorted(snapshot["retries"].items()):
+            lines.append('%s_retries_total{endpoint="%s",host="%s"} %d' % (prefix, endpoint, host, count))
+        return "\n".join(lines) + "\n"
+
+
+class CircuitOpenError(Exception):
+    # The host's circuit breaker is open, the request was not sent.
+    pass
+
+
+class CircuitBreaker:
+    """
+    Fails fast after failure_threshold consecutive failures of a host, then lets a single trial request through
+    every reset_timeout seconds until one succeeds.
+    """
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.__failure_threshold = failure_threshold
+        self.__reset_timeout = reset_timeout
+        self.__lock = threading.Lock()
+        self.__failures = 0
+        self.__opened_at = None
+        self.__trial = False
+
+    def allow(self) -> bool:
+        with self.__lock:
+            if self.__opened_at is None:
+                return True
+            if not self.__trial and time.monotonic() - self.__opened_at >= self.__reset_timeout:
+                self.__trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.__lock:
+            self.__failures = 0
+            self.__opened_at = None
+            self.__trial = False
+
+    def record_failure(self):
+        with self.__lock:
+            self.__failures += 1
+            if self.__trial or self.__failures >= self.__failure_threshold:
+                self.__opened_at = time.monotonic()
+            self.__trial = False
+
+    @property
+    def state(self) -> str:
+        if self.__opened_at is None:
+            return "closed"
+        return "half-open" if self.__trial else "open"
+
+
+def _not_sent(error: Exception) -> bool:
+    # the request never reached the exchange (no connection) or was refused unprocessed (rate limited)
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError):
+        reason = error.args[0] if error.args else None
+        if isinstance(reason, MaxRetryError):
+            reason = reason.reason
+        return isinstance(reason, ConnectTimeoutError)
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code in (418, 429)
+
+
+def _error_code(response) -> int:
+    # "code" of an exchange answer, 0 when the body has none or is not json
+    try:
+        body = _loads(response.content)
+    except ValueError:
+        return 0
+    return body.get("code", 0) if isinstance(body, dict) else 0
+
+
+def _host_unhealthy(error: Exception) -> bool:
+    # connection failures, timeouts, 5xx and rate limiting count against a host; other 4xx do not
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    return response is not None and (response.status_code >= 500 or response.status_code in (418, 429))
+
+
+class Resilience:
+    """
+    Retry, hedging and circuit breaking for BaseTokoCrypto.
+    - Failed GETs are retried with full-jitter exponential backoff. Other requests (orders, cancels, withdrawals)
+      are only resent when the failure proves the exchange never processed them: no connection was made, or 429/418.
+      After any other failure (read timeout, 5xx, dropped connection) the request may have been executed, and a
+      slow exchange may execute it after a lookup came back empty, so it is never resent: when a lookup is given
+      and finds the request its answer is returned, otherwise the original error is raised. BaseTokoCrypto looks
+      new orders up by clientId with account_query_order.
+      Signed retries are stamped and signed again once the WeightScheduler lets them go, a 429/418 back-off can
+      outlast recvWindow.
+    - Unsigned market GETs are hedged: when the first attempt has not answered the endpoint's p95 latency
+      (HEDGE_DELAY until enough samples) after it was actually sent, a duplicate is sent and the first answer wins.
+      Time spent waiting for a hedge thread or in the WeightScheduler queue does not count.
+    - Each host has a CircuitBreaker; while it is open requests fail with CircuitOpenError without being sent.
+    One policy can be shared by many clients.
+    """
+    def __init__(self, retries: int = RETRIES, backoff: float = RETRY_BACKOFF, max_backoff: float = RETRY_MAX_BACKOFF,
+                 hedge: bool = True, hedge_delay: float = None, hedge_quantile: float = HEDGE_QUANTILE,
+                 failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT,
+                 max_workers: int = DEFAULT_FANOUT_WORKERS):
+        """
+        :param retries: extra attempts after a retryable failure
+        :param backoff: base of the exponential backoff in seconds
+        :param max_backoff: cap of a single backoff in seconds
+        :param hedge: hedge unsigned market GETs
+        :param hedge_delay: fixed hedge delay in seconds instead of the measured quantile
+        :param hedge_quantile: latency quantile waited for before hedging
+        :param failure_threshold: see CircuitBreaker
+        :param reset_timeout: see CircuitBreaker
+        :param max_workers: threads running hedged attempts
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.hedge_quantile = hedge_quantile
+        self.__failure_threshold = failure_threshold
+        self.__reset_timeout = reset_timeout
+        self.__lock = threading.Lock()
+        self.__breakers = dict()
+        self.__latencies = dict()
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pytokocrypto-hedge")
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        breaker = self.__breakers.get(host)
+        if breaker is None:
+            with self.__lock:
+                breaker = self.__breakers.setdefault(host, CircuitBreaker(self.__failure_threshold,
+                                                                          self.__reset_timeout))
+        return breaker
+
+    def execute(self, plan: _RequestPlan, payload: dict, send, metrics: Metrics = None, lookup=None):
+        """
+        Run send() for plan under the retry, hedging and circuit breaker rules.
+        :param send: callable(sent=None) making one attempt; it sets the optional threading.Event sent as the request
+        goes out
+        :param lookup: callable(payload) returning the exchange's answer for a request that may already have been
+        executed, or None when the exchange does not know it; after an ambiguous failure of a non-GET its answer is
+        returned instead of raising, it never makes the request resendable
+        """
+        idempotent = plan.method == "GET"
+        if not any(payload.get(field) is not None for field in CLIENT_ID_FIELDS):
+            lookup = None
+        hedged = self.hedge and not plan.signed and idempotent
+        for attempt in range(1 + self.retries):
+            if attempt:
+                if metrics is not None:
+                    metrics.count_retry(plan.path, plan.host)
+                time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))))
+            try:
+                if hedged:
+                    return self.__hedged(plan, send)
+                return self.__attempt(plan, send)
+            except CircuitOpenError:
+                raise
+            except Exception as error:
+                if not _host_unhealthy(error):
+                    raise
+                if not idempotent and not _not_sent(error):
+                    # may have been executed: report it if the exchange already shows it, never send it again
+                    if lookup is not None:
+                        time.sleep(self.backoff)
+                        try:
+                            executed = lookup(payload)
+                        except Exception:
+                            raise error
+                        if executed is not None:
+                            return executed
+                    raise
+                if attempt == self.retries:
+                    raise
+
+    def __attempt(self, plan: _RequestPlan, send, sent: threading.Event = None):
+        # send(sent) sets sent when the request goes out; it is set here too should the attempt end before that
+        try:
+            breaker = self.breaker(plan.host)
+            if not breaker.allow():
+                raise CircuitOpenError("circuit open for %s" % plan.host)
+            started = time.perf_counter()
+            try:
+                response = send(sent) if sent is not None else send()
+            except Exception as error:
+                if _host_unhealthy(error):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                raise
+        finally:
+            if sent is not None:
+                sent.set()
+        breaker.record_success()
+        self.__record_latency(plan, time.perf_counter() - started)
+        return response
+
+    def __hedged(self, plan: _RequestPlan, send):
+        sent = threading.Event()
+        first = self.__executor.submit(self.__attempt, plan, send, sent)
+        sent.wait()
+        try:
+            return first.result(timeout=self.__hedge_delay(plan))
+        except FuturesTimeoutError:
+            pass
+        pending = {first, self.__executor.submit(self.__attempt, plan, send)}
+        error = None
+        while pending:
+            done, pending = futures_wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def __record_latency(self, plan: _RequestPlan, seconds: float):
+        key = (plan.host, plan.path)
+        with self.__lock:
+            samples = self.__latencies.get(key)
+            if samples is None:
+                samples = self.__latencies[key] = [[], None, 0]
+            window, _, count = samples
+            if len(window) >= 256:
+                window[count % 256] = seconds
+            else:
+                window.append(seconds)
+            samples[2] = count + 1
+            if len(window) >= HEDGE_MIN_SAMPLES and samples[2] % 16 == 0:
+                samples[1] = sorted(window)[int(self.hedge_quantile * (len(window) - 1))]
+
+    def __hedge_delay(self, plan: _RequestPlan) -> float:
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        samples = self.__latencies.get((plan.host, plan.path))
+        if samples is None or samples[1] is None:
+            return HEDGE_DELAY
+        return samples[1]
+
+    def close(self):
+        self.__executor.shutdown(wait=False)
+
+
+class SymbolIndex:
+    """
+    Routing index compiled from the supported trading symbol list: symbol -> (route, market symbol), where route is
+    ROUTE_BINANCE or ROUTE_TOKOCRYPTO and market symbol is the symbol as the routed host expects it.
+    The list is loaded lazily, cached on disk for ttl seconds and refreshed in the background once stale.
+    One index can be shared by many clients.
+    """
+    def __init__(self, fetch=None, cache_path: str = SYMBOL_CACHE_PATH, ttl: float = SYMBOL_CACHE_TTL,
+                 min_refresh_interval: float = SYMBOL_MIN_REFRESH_INTERVAL):
+        """
+        :param fetch: callable returning the symbol list (rows with "symbol" and "type"), None for a cache-only index
+        :param cache_path: json file holding the last fetched list, None to disable the disk cache
+        :param ttl: seconds before the list is refreshed
+        :param min_refresh_interval: minimum seconds between two refreshes triggered by unknown symbols
+        """
+        self.fetch = fetch
+        self.__cache_path = cache_path
+        self.__ttl = ttl
+        self.__min_refresh_interval = min_refresh_interval
+        self.__lock = threading.Condition()
+        self.__routes = None
+        self.__symbol_type = {}
+        self.__updated_at = 0.0
+        self.__last_refresh = None
+        self.__refreshing = False
+
+    def get(self, symbol: str):
+        # Route of a symbol, None when unknown. Never touches the network.
+        if self.__routes is None:
+            self.__load_cache()
+        return self.__routes.get(symbol)
+
+    def route(self, symbol: str):
+        # Route of a symbol; an unknown symbol triggers a single synchronous refresh before raising KeyError.
+        # Concurrent callers wait for the refresh already running instead of starting their own.
+        route = self.get(symbol)
+        if route is None:
+            if self.claim_refresh():
+                self.refresh()
+            else:
+                self.wait_refresh()
+            route = self.__routes.get(symbol)
+            if route is None:
+                raise KeyError(symbol)
+        elif self.stale and self.claim_refresh(background=True):
+            threading.Thread(target=self.refresh, kwargs={"background": True}, daemon=True).start()
+        return route
+
+    def claim_refresh(self, background: bool = False) -> bool:
+        # Reserve the next refresh, refused while one is running or when the last one is too recent.
+        with self.__lock:
+            if self.__refreshing:
+                return False
+            now = time.monotonic()
+            if not background and self.__last_refresh is not None and \
+                    now - self.__last_refresh < self.__min_refresh_interval:
+                return False
+            self.__refreshing = True
+            self.__last_refresh = now
+            return True
+
+    def refresh(self, background: bool = False):
+        # Fetch the symbol list again, the caller must have claimed the refresh.
+        try:
+            self.update(self.fetch())
+        except Exception:
+            if not background:
+                raise
+        finally:
+            self.release_refresh()
+
+    def release_refresh(self):
+        with self.__lock:
+            self.__refreshing = False
+            self.__lock.notify_all()
+
+    def wait_refresh(self, timeout: float = None) -> bool:
+        # Block until the running refresh (if any) is over, False on timeout.
+        with self.__lock:
+            return self.__lock.wait_for(lambda: not self.__refreshing, timeout)
+
+    @property
+    def refreshing(self) -> bool:
+        return self.__refreshing
+
+    def update(self, rows: list):
+        # Compile a freshly fetched symbol list and persist it.
+        self.__compile({data["symbol"]: data["type"] for data in rows}, time.time())
+        if self.__cache_path:
+            try:
+                os.makedirs(os.path.dirname(self.__cache_path), exist_ok=True)
+                tmp_path = "%s.%d.tmp" % (self.__cache_path, os.getpid())
+                with open(tmp_path, "w") as f:
+                    json.dump({"timestamp": self.__updated_at, "symbols": self.__symbol_type}, f)
+                os.replace(tmp_path, self.__cache_path)
+            except OSError:
+                pass
+
+    def __compile(self, symbol_type: dict, updated_at: float):
+        routes = dict()
+        for symbol, type_ in symbol_type.items():
+            if type_ == 1:
+                routes[symbol] = (ROUTE_BINANCE, symbol.replace("_", ""))
+            else:
+                routes[symbol] = (ROUTE_TOKOCRYPTO, symbol)
+        self.__symbol_type = symbol_type
+        self.__updated_at = updated_at
+        self.__routes = routes
+
+    def __load_cache(self):
+        symbol_type, updated_at = dict(), 0.0
+        if self.__cache_path:
+            try:
+                with open(self.__cache_path) as f:
+                    cache = json.load(f)
+                symbol_type, updated_at = cache["symbols"], cache["timestamp"]
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        with self.__lock:
+            if self.__routes is None:
+                self.__compile(symbol_type, updated_at)
+
+    @property
+    def stale(self) -> bool:
+        return time.time() - self.__updated_at > self.__ttl
+
+    @property
+    def symbol_type(self) -> dict:
+        if self.__routes is None:
+            self.__load_cache()
+        return self.__symbol_type
 
-    def __get_symbol_type(self):
-        response = self.general_supported_trading_symbol()
-        symbol_type = {data["symbol"]: data["type"] for data in response.json()["data"]["list"]}
-        return symbol_type
 
-    def __request(self, **kwargs):
-        payload = kwargs["payload"]
-        endpoint_url = kwargs["endpoint_url"]
-        method = kwargs["method"]
-        signed = kwargs["signed"]
+def _page_rows(response) -> list:
+    # rows of a paged endpoint: {"code": 0, "data": {"list": [...]}}
+    data = response.json()["data"]
+    return data["list"] if isinstance(data, dict) else data
 
-        parameter = dict()
-        [parameter.update({key: payload[key]}) for key in payload.keys() if payload[key]]
 
-        signature = self.__hash_signature(parameter)
-        parameter['signature'] = signature
+class PageIterator:
+    """
+    Yields the rows of a paged history endpoint one at a time, fetching the next page in the background while the
+    current one is consumed, so at most two pages are held in memory.
+    cursor is the id of the last row handed out; pass it back as cursor= to resume right after that row.
+    """
+    def __init__(self, fetch_page, id_key: str, cursor=None, page_size: int = None):
+        """
+        :param fetch_page: callable(from_id) returning the rows of one page, from_id is None for the first page
+        :param id_key: row field used as fromId for the next page
+        :param cursor: resume after the row with this id
+        :param page_size: rows per full page, a shorter page ends the iteration; None to stop on an empty page only
+        """
+        self.__fetch_page = fetch_page
+        self.__id_key = id_key
+        self.__page_size = page_size
+        self.cursor = cursor
+        self.__generator = self.__generate()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.__generator)
+
+    def close(self):
+        # Stop iterating and drop the page being prefetched.
+        self.__generator.close()
+
+    def __generate(self):
+        id_key = self.__id_key
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            last_id = self.cursor
+            seen = set()
+            future = executor.submit(self.__fetch_page, last_id)
+            while future is not None:
+                rows = future.result()
+                full_page = self.__page_size is None or len(rows) >= self.__page_size
+                # fromId is inclusive on some endpoints: drop the row already handed out
+                if rows and last_id is not None and str(rows[0][id_key]) == str(last_id):
+                    rows = rows[1:]
+                # a page that ends on a row of the previous page did not move forward (fromId ignored): stop
+                if not rows or str(rows[-1][id_key]) in seen:
+                    return
+                seen = {str(row[id_key]) for row in rows}
+                last_id = rows[-1][id_key]
+                future = executor.submit(self.__fetch_page, last_id) if full_page else None
+                for row in rows:
+                    self.cursor = row[id_key]
+                    yield row
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class BatchResult:
+    # Outcome of one symbol in a market_batch call: response is set on success, error on failure.
+    __slots__ = ("symbol", "params", "response", "error")
+
+    def __init__(self, symbol: str, params: dict, response=None, error: Exception = None):
+        self.symbol = symbol
+        self.params = params
+        self.response = response
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return "BatchResult(symbol=%r, %s)" % (self.symbol, "ok" if self.ok else "error=%r" % self.error)
+
+
+def _depth_body(depth) -> dict:
+    # market_order_book answer (Response or decoded json), Tokocrypto wraps it in "data" while Binance does not
+    if hasattr(depth, "json"):
+        depth = depth.json()
+    return depth["data"] if "data" in depth else depth
+
+
+class OrderBookGapError(Exception):
+    # A diff does not follow the book's last update id, the book must be seeded again from a snapshot.
+    pass
+
+
+class _BookSide:
+    """
+    Price levels of one side in two parallel float arrays sorted by key, best level last so that top-of-book
+    reads and changes near the top are O(1). The key is the price for bids and -price for asks.
+    """
+    __slots__ = ("sign", "keys", "quantities")
+
+    def __init__(self, sign: float):
+        self.sign = sign
+        self.keys = array("d")
+        self.quantities = array("d")
+
+    def set(self, price: float, quantity: float) -> bool:
+        # Set (quantity > 0) or remove (quantity == 0) a level, return False when nothing changed.
+        key = price * self.sign
+        keys = self.keys
+        index = bisect.bisect_left(keys, key)
+        found = index < len(keys) and keys[index] == key
+        if quantity > 0:
+            if found:
+                if self.quantities[index] == quantity:
+                    return False
+                self.quantities[index] = quantity
+            else:
+                keys.insert(index, key)
+                self.quantities.insert(index, quantity)
+            return True
+        if found:
+            del keys[index]
+            del self.quantities[index]
+            return True
+        return False
+
+    def replace(self, levels: list) -> int:
+        # Make the side equal to a snapshot, touching only levels that differ; return the number of changes.
+        if not self.keys:
+            levels = sorted(((float(price) * self.sign, float(quantity)) for price, quantity in levels))
+            self.keys = array("d", [key for key, quantity in levels if quantity > 0])
+            self.quantities = array("d", [quantity for key, quantity in levels if quantity > 0])
+            return len(self.keys)
+        sign = self.sign
+        wanted = {float(price) * sign: float(quantity) for price, quantity in levels}
+        changes = 0
+        for key in [key for key in self.keys if key not in wanted]:
+            changes += self.set(key * sign, 0.0)
+        for key, quantity in wanted.items():
+            changes += self.set(key * sign, quantity)
+        return changes
+
+    def best(self):
+        if not self.keys:
+            return None
+        return self.keys[-1] * self.sign, self.quantities[-1]
+
+    def depth_to(self, price: float) -> float:
+        return sum(self.quantities[bisect.bisect_left(self.keys, price * self.sign):])
+
+    def vwap(self, size: float):
+        if size <= 0:
+            raise ValueError("vwap size must be positive, got %r" % size)
+        remaining, notional = size, 0.0
+        keys, quantities = self.keys, self.quantities
+        for index in range(len(keys) - 1, -1, -1):
+            filled = min(remaining, quantities[index])
+            notional += filled * keys[index] * self.sign
+            remaining -= filled
+            if remaining <= 0:
+                return notional / size
+        return None
+
+    def levels(self, limit: int = None) -> list:
+        count = len(self.keys) if limit is None else min(limit, len(self.keys))
+        return [(self.keys[-1 - i] * self.sign, self.quantities[-1 - i]) for i in range(count)]
+
+
+class OrderBook:
+    """
+    Local order book of one symbol kept in compact sorted arrays. Seed it from a market_order_book snapshot, then
+    apply newer snapshots or diffs; only changed levels are touched and queries never re-parse or re-sort.
+    """
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.last_update_id = None
+        self.bids = _BookSide(1.0)
+        self.asks = _BookSide(-1.0)
+
+    def apply_snapshot(self, depth) -> int:
+        # Apply a market_order_book answer, return the number of changed levels.
+        body = _depth_body(depth)
+        changes = self.bids.replace(body["bids"]) + self.asks.replace(body["asks"])
+        self.last_update_id = body.get("lastUpdateId")
+        return changes
+
+    def apply_diff(self, bids: list, asks: list, first_update_id: int = None, last_update_id: int = None) -> int:
+        """
+        Apply changed levels, a quantity of 0 removes the level.
+        :param bids: [[price, quantity], ...]
+        :param asks: [[price, quantity], ...]
+        :param first_update_id: first update id in the diff, checked against the book to detect gaps
+        :param last_update_id: last update id in the diff; diffs older than the book are ignored
+        :return: number of changed levels
+        """
+        if last_update_id is not None and self.last_update_id is not None:
+            if last_update_id <= self.last_update_id:
+                return 0
+            if first_update_id is not None and first_update_id > self.last_update_id + 1:
+                raise OrderBookGapError("%s: missed updates %d to %d" % (self.symbol, self.last_update_id + 1,
+                                                                          first_update_id - 1))
+        changes = 0
+        for price, quantity in bids:
+            changes += self.bids.set(float(price), float(quantity))
+        for price, quantity in asks:
+            changes += self.asks.set(float(price), float(quantity))
+        if last_update_id is not None:
+            self.last_update_id = last_update_id
+        return changes
+
+    def best_bid(self):
+        # (price, quantity) of the best bid, None when the side is empty
+        return self.bids.best()
+
+    def best_ask(self):
+        return self.asks.best()
+
+    def spread(self):
+        if not self.bids.keys or not self.asks.keys:
+            return None
+        return -self.asks.keys[-1] - self.bids.keys[-1]
+
+    def mid_price(self):
+        if not self.bids.keys or not self.asks.keys:
+            return None
+        return (-self.asks.keys[-1] + self.bids.keys[-1]) / 2
+
+    def depth_to_price(self, side: str, price: float) -> float:
+        # Total quantity on side ("bid" or "ask") at prices as good as or better than price.
+        return self.__side(side).depth_to(price)
+
+    def vwap(self, side: str, size: float):
+        # Average price of filling size (> 0) against side ("ask" when buying, "bid" when selling), None if too thin.
+        return self.__side(side).vwap(size)
+
+    def __side(self, side: str) -> _BookSide:
+        if side == "bid":
+            return self.bids
+        if side == "ask":
+            return self.asks
+        raise ValueError("side must be 'bid' or 'ask'")
+
+
+# columnar layouts of market data; price-like fields become int64 when a fixed-point price_scale is given
+KLINE_FIELDS = (("open_time", "i8"), ("open", "f8"), ("high", "f8"), ("low", "f8"), ("close", "f8"),
+                ("volume", "f8"), ("close_time", "i8"), ("quote_volume", "f8"), ("trades", "i8"),
+                ("taker_buy_base_volume", "f8"), ("taker_buy_quote_volume", "f8"))
+TRADE_FIELDS = (("id", "i8"), ("price", "f8"), ("qty", "f8"), ("quote_qty", "f8"), ("time", "i8"),
+                ("is_buyer_maker", "?"))
+AGG_TRADE_FIELDS = (("agg_id", "i8"), ("price", "f8"), ("qty", "f8"), ("first_id", "i8"), ("last_id", "i8"),
+                    ("time", "i8"), ("is_buyer_maker", "?"))
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("columnar output requires numpy, install it with `pip install numpy`")
+
+
+def _dtype(fields: tuple, price_scale: int = None):
+    if price_scale is None:
+        return np.dtype(list(fields))
+    return np.dtype([(name, "i8" if kind == "f8" else kind) for name, kind in fields])
+
+
+def _fill(array, name: str, values, kind: str, price_scale: int = None):
+    if price_scale is not None and kind == "f8":
+        values = np.rint(values * price_scale)
+    array[name] = values
+
+
+def _body_rows(response) -> list:
+    # rows of a list answer: a bare list (Binance), {"data": [...]} or {"data": {"list": [...]}} (Tokocrypto)
+    body = response.json() if hasattr(response, "json") else response
+    data = body["data"] if isinstance(body, dict) else body
+    return data["list"] if isinstance(data, dict) else data
+
+
+def klines_to_array(response, price_scale: int = None):
+    """
+    Parse a market_candlestick_data answer straight into a structured array with KLINE_FIELDS columns.
+    The raw body is scanned as numbers, without building a Python object per row or field.
+    :param response: requests.Response, raw body bytes, or already decoded json
+    :param price_scale: store prices and volumes as int64 fixed point (value * price_scale) instead of float64
+    """
+    _require_numpy()
+    dtype = _dtype(KLINE_FIELDS, price_scale)
+    content = response.content if hasattr(response, "content") else response
+    if isinstance(content, (bytes, str)):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        start, end = content.find(b"[["), content.rfind(b"]]")
+        if start < 0:
+            return np.empty(0, dtype=dtype)
+        body = content[start:end + 2]
+        rows = body.count(b"]") - 1
+        values = np.fromstring(body.translate(None, b'[]" ').decode("ascii"), dtype=np.float64, sep=",")
+        if rows == 0 or values.size % rows:
+            return klines_to_array(json.loads(content), price_scale)
+        values = values.reshape(rows, -1)
+    else:
+        rows = _body_rows(content)
+        if not rows:
+            return np.empty(0, dtype=dtype)
+        values = np.array([row[:len(KLINE_FIELDS)] for row in rows], dtype=np.float64)
+    result = np.empty(len(values), dtype=dtype)
+    for index, (name, kind) in enumerate(KLINE_FIELDS):
+        _fill(result, name, values[:, index], kind, price_scale)
+    return result
+
+
+def trades_to_array(response, price_scale: int = None):
+    # Parse a market_recent_trades_list answer into a structured array with TRADE_FIELDS columns.
+    _require_numpy()
+    rows = _body_rows(response)
+    result = np.empty(len(rows), dtype=_dtype(TRADE_FIELDS, price_scale))
+    for (name, kind), key in zip(TRADE_FIELDS, ("id", "price", "qty", "quoteQty", "time", "isBuyerMaker")):
+        values = np.array([row[key] for row in rows], dtype=np.float64 if kind == "f8" else None)
+        _fill(result, name, values, kind, price_scale)
+    return result
+
+
+def agg_trades_to_array(response, price_scale: int = None):
+    # Parse a market_aggregate_trade_list answer into a structured array with AGG_TRADE_FIELDS columns.
+    _require_numpy()
+    rows = _body_rows(response)
+    result = np.empty(len(rows), dtype=_dtype(AGG_TRADE_FIELDS, price_scale))
+    for (name, kind), key in zip(AGG_TRADE_FIELDS, ("a", "p", "q", "f", "l", "T", "m")):
+        values = np.array([row[key] for row in rows], dtype=np.float64 if kind == "f8" else None)
+        _fill(result, name, values, kind, price_scale)
+    return result
+
+
+def depth_to_arrays(response, price_scale: int = None) -> dict:
+    # Parse a market_order_book answer into {"bids": (n, 2) array, "asks": (n, 2) array} of price, quantity.
+    _require_numpy()
+    body = _depth_body(response)
+    result = {"lastUpdateId": body.get("lastUpdateId")}
+    for side in ("bids", "asks"):
+        levels = np.array(body[side], dtype=np.float64).reshape(-1, 2)
+        result[side] = levels if price_scale is None else np.rint(levels * price_scale).astype(np.int64)
+    return result
+
+
+# account_new_order argument -> order payload field, in payload order
+ORDER_FIELDS = (("symbol", "symbol"), ("side", "side"), ("type_", "type"), ("time_in_force", "timeInForce"),
+                ("quantity", "quantity"), ("quote_order_qty", "quoteOrderQty"), ("price", "price"),
+                ("client_id", "clientId"), ("stop_price", "stopPrice"), ("iceberg_qty", "icebergQty"))
+
+
+class OrderResult:
+    # Outcome of one order or cancel in a bulk call: response is set on success, error on failure.
+    __slots__ = ("request", "client_id", "response", "error", "latency")
+
+    def __init__(self, request, client_id: str = None):
+        self.request = request
+        self.client_id = client_id
+        self.response = None
+        self.error = None
+        self.latency = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return "OrderResult(request=%r, %s)" % (self.request, "ok" if self.ok else "error=%r" % self.error)
+
 
-        url = endpoint_url
+class BulkOrderResult:
+    # Per-order results of account_new_orders / account_cancel_orders in input order, with timing statistics.
+    def __init__(self, results: list, wall_time: float):
+        self.results = results
+        self.wall_time = wall_time
 
-        request_payload = {
-            "url": url,
-            "params": parameter
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __getitem__(self, index):
+        return self.results[index]
+
+    @property
+    def failed(self) -> list:
+        return [result for result in self.results if not result.ok]
+
+    def stats(self) -> dict:
+        latencies = sorted(result.latency for result in self.results if result.latency is not None)
+
+        def quantile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+        return {
+            "orders": len(self.results),
+            "failed": len(self.failed),
+            "wall_time": self.wall_time,
+            "p50": quantile(0.5),
+            "p99": quantile(0.99),
+            "max": latencies[-1] if latencies else None
         }
+
+
+def _field(key, convert=None):
+    # read-only model attribute, converted from the raw row on every access
+    def get(self):
+        try:
+            value = self._raw[key]
+        except (KeyError, IndexError):
+            return None
+        return value if convert is None or value is None else convert(value)
+    return property(get)
+
+
+class _Model:
+    """
+    Typed view of one decoded row. Fields are converted when read, so a model costs one small object and nothing
+    until it is used. json() returns the decoded answer the model was built from.
+    """
+    __slots__ = ("_raw", "_body")
+    _fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = tuple(name for name, value in vars(cls).items() if isinstance(value, property))
+
+    def __init__(self, raw, body=None):
+        self._raw = raw
+        self._body = body
+
+    def json(self):
+        return self._raw if self._body is None else self._body
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self._fields}
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other._raw == self._raw
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join("%s=%r" % item for item in self.to_dict().items()))
+
+
+class Order(_Model):
+    __slots__ = ()
+    order_id = _field("orderId")
+    client_id = _field("clientId")
+    symbol = _field("symbol")
+    side = _field("side")
+    type = _field("type")
+    price = _field("price", float)
+    orig_qty = _field("origQty", float)
+    executed_qty = _field("executedQty", float)
+    stop_price = _field("stopPrice", float)
+    status = _field("status")
+    time_in_force = _field("timeInForce")
+    create_time = _field("createTime")
+
+
+class Trade(_Model):
+    # market_recent_trades_list row
+    __slots__ = ()
+    id = _field("id")
+    price = _field("price", float)
+    qty = _field("qty", float)
+    quote_qty = _field("quoteQty", float)
+    time = _field("time")
+    is_buyer_maker = _field("isBuyerMaker")
+
+
+class AggTrade(_Model):
+    # market_aggregate_trade_list row
+    __slots__ = ()
+    agg_id = _field("a")
+    price = _field("p", float)
+    qty = _field("q", float)
+    first_id = _field("f")
+    last_id = _field("l")
+    time = _field("T")
+    is_buyer_maker = _field("m")
+
+
+class AccountTrade(_Model):
+    # account_trade_list row
+    __slots__ = ()
+    trade_id = _field("tradeId")
+    order_id = _field("orderId")
+    symbol = _field("symbol")
+    price = _field("price", float)
+    qty = _field("qty", float)
+    commission = _field("commission", float)
+    commission_asset = _field("commissionAsset")
+    is_buyer = _field("isBuyer")
+    is_maker = _field("isMaker")
+    time = _field("time")
+
+
+class Kline(_Model):
+    # market_candlestick_data row, a positional list
+    __slots__ = ()
+    open_time = _field(0)
+    open = _field(1, float)
+    high = _field(2, float)
+    low = _field(3, float)
+    close = _field(4, float)
+    volume = _field(5, float)
+    close_time = _field(6)
+    quote_volume = _field(7, float)
+    trades = _field(8)
+    taker_buy_base_volume = _field(9, float)
+    taker_buy_quote_volume = _field(10, float)
+
+
+def _levels(rows: list) -> list:
+    return [(float(price), float(quantity)) for price, quantity, *_ in rows]
+
+
+class Depth(_Model):
+    # market_order_book answer, bids and asks as (price, quantity) floats
+    __slots__ = ()
+    last_update_id = _field("lastUpdateId")
+    bids = _field("bids", _levels)
+    asks = _field("asks", _levels)
+
+
+class OrderList(_Model):
+    # account_new_oco answer, orders holds both legs as Order models
+    __slots__ = ()
+    order_list_id = _field("orderListId")
+    list_client_id = _field("listClientId")
+    contingency_type = _field("contingencyType")
+    list_status_type = _field("listStatusType")
+    list_order_status = _field("listOrderStatus")
+    transaction_time = _field("transactionTime")
+
+    @property
+    def orders(self):
+        return ModelList(self._raw.get("orderReports") or self._raw.get("orders") or [], Order)
+
+
+class Balance(_Model):
+    __slots__ = ()
+    asset = _field("asset")
+    free = _field("free", float)
+    locked = _field("locked", float)
+
+
+class Deposit(_Model):
+    __slots__ = ()
+    id = _field("id")
+    asset = _field("asset")
+    network = _field("network")
+    address = _field("address")
+    address_tag = _field("addressTag")
+    amount = _field("amount", float)
+    tx_id = _field("txId")
+    status = _field("status")
+    insert_time = _field("insertTime")
+
+
+class DepositAddress(_Model):
+    # wallet_deposit_address answer
+    __slots__ = ()
+    asset = _field("asset")
+    network = _field("network")
+    address = _field("address")
+    address_tag = _field("addressTag")
+
+
+class Withdrawal(_Model):
+    # wallet_withdraw_history row, or the wallet_withdraw answer which only carries withdraw_id
+    __slots__ = ()
+    id = _field("id")
+    withdraw_id = _field("withdrawId")
+    client_id = _field("clientId")
+    asset = _field("asset")
+    network = _field("network")
+    address = _field("address")
+    address_tag = _field("addressTag")
+    amount = _field("amount", float)
+    fee = _field("fee", float)
+    tx_id = _field("txId")
+    status = _field("status")
+    apply_time = _field("applyTime")
+
+
+class ModelList:
+    """
+    Sequence of models over the decoded rows of a list answer. Only the models are lazy: the answer is decoded in
+    full up front (a dict or list per row), and a model is built when its row is read. json() returns the decoded
+    answer, as on requests.Response.
+    """
+    __slots__ = ("_rows", "_model", "_body")
+
+    def __init__(self, rows: list, model, body=None):
+        self._rows = rows
+        self._model = model
+        self._body = body
+
+    def json(self):
+        return self._rows if self._body is None else self._body
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ModelList(self._rows[index], self._model)
+        return self._model(self._rows[index])
+
+    def __iter__(self):
+        model = self._model
+        for row in self._rows:
+            yield model(row)
+
+    def __repr__(self):
+        return "ModelList(%s, %d rows)" % (self._model.__name__, len(self._rows))
+
+
+def to_models(body, model, keys: tuple = ()):
+    """
+    Wrap a decoded answer (or a Response, decoded in full with orjson when installed) in model, or in a ModelList
+    of model for list answers. The rows are looked up under "data", then under "list" or the first of keys present.
+    """
+    if hasattr(body, "content"):
+        body = _loads(body.content)
+    data = body.get("data", body) if isinstance(body, dict) else body
+    if isinstance(data, dict):
+        for key in keys + ("list",):
+            if key in data:
+                data = data[key]
+                break
+    if isinstance(data, list):
+        return ModelList(data, model, body)
+    return model(data, body)
+
+
+class BaseTokoCrypto:
+    def __init__(self, api_key: str = None, secret_key: str = None, session: requests.Session = None,
+                 timeout=DEFAULT_TIMEOUT, pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize: int = DEFAULT_POOL_MAXSIZE, pool_block: bool = False, symbols: SymbolIndex = None,
+                 scheduler: WeightScheduler = None, clock: ClockSync = None, cache: ResponseCache = None,
+                 metrics: Metrics = None, resilience: Resilience = None, models: bool = False):
+        """
+        :param api_key:
+        :param secret_key:
+        :param session: shared session from create_session(); a private one is created (and owned) if not sent
+        :param timeout: seconds, or a (connect, read) tuple, applied to every request
+        :param pool_connections: see create_session, ignored when session is sent
+        :param pool_maxsize: see create_session, ignored when session is sent
+        :param pool_block: see create_session, ignored when session is sent
+        :param symbols: shared SymbolIndex; a private one fetching through this client is created if not sent
+        :param scheduler: shared WeightScheduler pacing requests, a private one is created if not sent
+        :param clock: shared ClockSync stamping signed requests, a private one is created if not sent
+        :param cache: ResponseCache for the public market endpoints, no caching if not sent
+        :param metrics: Metrics collecting latencies and status codes, no instrumentation if not sent
+        :param resilience: Resilience policy for retries, hedging and circuit breaking, one attempt per call if not
+        sent
+        :param models: return typed models (Order, Trade, Kline, ModelList...) instead of responses, see to_models
+        """
+        self.__api_key = api_key
+        self.__secret_key = secret_key
+        self.__headers = {"X-MBX-APIKEY": self.__api_key}
+        self.__signer = _Signer(secret_key) if secret_key is not None else None
+        self.__timeout = timeout
+        self.__owns_session = session is None
+        if session is None:
+            session = create_session(pool_connections, pool_maxsize, pool_block)
+        self.__session = session
+        if symbols is None:
+            symbols = SymbolIndex()
+        if symbols.fetch is None:
+            symbols.fetch = self.__get_symbol_list
+        self.__symbols = symbols
+        self.__scheduler = scheduler if scheduler is not None else WeightScheduler()
+        self.__owns_clock = clock is None
+        self.__clock = clock if clock is not None else ClockSync(session=session, timeout=timeout)
+        self.__cache = cache
+        self.__metrics = metrics
+        self.__resilience = resilience
+        self.__models = models
+
+    def close(self):
+        # Release pooled connections, a shared session is left open for its other clients.
+        if self.__owns_clock:
+            self.__clock.stop()
+        if self.__owns_session:
+            self.__session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __get_symbol_list(self):
+        response = self.general_supported_trading_symbol(session=self.__session, timeout=self.__timeout)
+        response.raise_for_status()
+        return response.json()["data"]["list"]
+
+    def __route(self, symbol: str, endpoint_url: str, binance_url: str):
+        route, symbol = self.__symbols.route(symbol)
+        if route == ROUTE_BINANCE:
+            return binance_url, symbol
+        return BASE_URL + endpoint_url, symbol
+
+    def __request(self, method: str, payload: dict, endpoint_url: str, signed: bool):
+        plan, url = self.__prepare(method, payload, endpoint_url, signed)
+        if self.__cache is not None and not signed:
+            ttl = self.__cache.ttl(plan.path)
+            if ttl:
+                return self.__cache.get_or_fetch(url, ttl, lambda: self.__dispatch(plan, payload, url, None))
         # accessing account endpoint that required to be SIGNED (apiKey and secretKey)
-        if signed:
-            request_payload["headers"] = self.__headers
-        response = None
-        if method == "get":
-            response = requests.get(**request_payload)
-        elif method == "post":
-            response = requests.post(**request_payload)
-        elif method == "put":
-            response = requests.put(**request_payload)
-        elif method == "delete":
-            response = requests.delete(**request_payload)
-        
+        return self.__dispatch(plan, payload, url, self.__headers if signed else None)
+
+    def __prepare(self, method: str, payload: dict, endpoint_url: str, signed: bool):
+        plan = _get_plan(method, endpoint_url, signed)
+        if self.__metrics is None:
+            return plan, plan.prepare(payload, self.__signer)
+        started = time.perf_counter()
+        url = plan.prepare(payload, self.__signer)
+        self.__metrics.observe("sign", plan.path, plan.host, time.perf_counter() - started)
+        return plan, url
+
+    def __dispatch(self, plan: _RequestPlan, payload: dict, url: str, headers: dict):
+        if self.__resilience is None:
+            return self.__send(plan, url, headers)
+        lookup = self.__find_order if plan.method == "POST" and plan.path == ACCOUNT_NEW_ORDER_URL else None
+        attempts = itertools.count()
+
+        def send(sent=None):
+            # retries of a signed request are stamped again after the scheduler's wait
+            restamp = plan.signed and "timestamp" in payload and next(attempts) > 0
+            return self.__send(plan, url, headers, sent, payload if restamp else None)
+        return self.__resilience.execute(plan, payload, send, self.__metrics, lookup)
+
+    def __find_order(self, payload: dict):
+        # Answer of an order placed with payload's clientId, None only when the exchange says it does not exist.
+        query = {
+            "clientId": payload["clientId"],
+            "recvWindow": payload.get("recvWindow"),
+            "timestamp": self.__clock.timestamp()
+        }
+        try:
+            response = self.__request(method="get", payload=query, endpoint_url=BASE_URL + ACCOUNT_QUERY_ORDER_URL,
+                                      signed=True)
+        except requests.HTTPError as error:
+            if error.response is not None and _error_code(error.response) == ORDER_NOT_FOUND_CODE:
+                return None
+            raise
+        code = _error_code(response)
+        if code == ORDER_NOT_FOUND_CODE:
+            return None
+        if code:
+            raise ValueError("order lookup failed with code %s" % code)
+        return response
+
+    def __restamp(self, plan: _RequestPlan, payload: dict) -> str:
+        payload = dict(payload, timestamp=self.__clock.timestamp())
+        return plan.prepare(payload, self.__signer)
+
+    def __send(self, plan: _RequestPlan, url: str, headers: dict, sent: threading.Event = None, payload: dict = None):
+        # sent is set once the request leaves the scheduler queue, Resilience times its hedge from there;
+        # a payload is stamped and signed again at that point, for retries
+        if self.__metrics is not None:
+            return self.__send_measured(plan, url, headers, sent, payload)
+        self.__scheduler.acquire(plan.host, plan.weight, plan.priority)
+        if payload is not None:
+            url = self.__restamp(plan, payload)
+        if sent is not None:
+            sent.set()
+        response = self.__session.request(plan.method, url, headers=headers, timeout=self.__timeout)
+        self.__scheduler.observe(plan.host, response)
         response.raise_for_status()
         return response
 
-    def __hash_signature(self, parameter: dict) -> str:
-        # hashing secret_key to signature code using HMAC SHA256
-        query_string = urlencode(parameter, True)
-        m = hmac.new(self.__secret_key.encode("utf-8"), query_string.encode("utf-8"), hashlib.sha256)
-        signature = m.hexdigest()
-        return signature
+    def __send_measured(self, plan: _RequestPlan, url: str, headers: dict, sent: threading.Event = None,
+                        payload: dict = None):
+        metrics = self.__metrics
+        metrics.before(plan.method, url)
+        started = time.perf_counter()
+        self.__scheduler.acquire(plan.host, plan.weight, plan.priority)
+        metrics.observe("queue", plan.path, plan.host, time.perf_counter() - started)
+        if payload is not None:
+            url = self.__restamp(plan, payload)
+        if sent is not None:
+            sent.set()
+        response = None
+        try:
+            response = self.__session.request(plan.method, url, headers=headers, timeout=self.__timeout)
+            self.__scheduler.observe(plan.host, response)
+            response.raise_for_status()
+        except Exception as error:
+            metrics.after(plan, url, response, error, time.perf_counter() - started)
+            raise
+        metrics.after(plan, url, response, None, time.perf_counter() - started)
+        return response
+
+    def __decode(self, response):
+        if self.__metrics is None:
+            return _loads(response.content)
+        started = time.perf_counter()
+        body = _loads(response.content)
+        url = urlsplit(response.url)
+        self.__metrics.observe("decode", url.path, url.netloc, time.perf_counter() - started)
+        return body
+
+    def __model(self, response, model, keys: tuple = ()):
+        # response as is, or decoded into models when the client was created with models=True
+        if not self.__models:
+            return response
+        return to_models(self.__decode(response), model, keys)
 
     @staticmethod
-    def general_check_server_time() -> datetime:
+    def general_check_server_time(session: requests.Session = None, timeout=DEFAULT_TIMEOUT) -> datetime:
         # Test connectivity to the Rest API and get the current server time.
-        endpoint_url = BASE_URL + GENERAL_CHECK_SERVER_TIME_URL
-
-        url = BASE_URL + endpoint_url
-        response = requests.get(url=url)
+        url = BASE_URL + GENERAL_CHECK_SERVER_TIME_URL
+        response = (session or requests).get(url=url, timeout=timeout)
         response.raise_for_status()
-        print("Server is Connect")
         timestamp = int(response.json()['timestamp']) / 1000
         dt_object = datetime.fromtimestamp(timestamp)
         return dt_object
 
     @staticmethod
-    def general_supported_trading_symbol():
+    def general_supported_trading_symbol(session: requests.Session = None, timeout=DEFAULT_TIMEOUT):
         # This endpoint returns all Exchange's supported trading symbol.
         url = BASE_URL + GENERAL_SUPPORTED_TRADING_SYMBOL_URL
-        response = requests.get(url=url)
+        response = (session or requests).get(url=url, timeout=timeout)
         return response
 
     def market_order_book(self, symbol: str, limit: int = None):
         # Send in a new order.
-        if self.__symbol_type[symbol] == 1:
-            endpoint_url = MARKET_ORDER_BOOK_BINANCE_URL
-            symbol = symbol.replace("_", "")
-        else:
-            endpoint_url = BASE_URL + MARKET_ORDER_BOOK_URL
+        endpoint_url, symbol = self.__route(symbol, MARKET_ORDER_BOOK_URL, MARKET_ORDER_BOOK_BINANCE_URL)
 
         payload = {
             "symbol": symbol,
@@ -123,15 +1873,13 @@ class BaseTokoCrypto:
         }
 
         response = self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=False)
-        return response
+        return self.__model(response, Depth)
 
-    def market_recent_trades_list(self, symbol: str, from_id: int = None, limit: int = None):
-        # Send in a new order.
-        if self.__symbol_type[symbol] == 1:
-            endpoint_url = MARKET_RECENT_TRADES_LIST_BINANCE_URL
-            symbol = symbol.replace("_", "")
-        else:
-            endpoint_url = BASE_URL + MARKET_RECENT_TRADES_LIST_URL
+    def market_recent_trades_list(self, symbol: str, from_id: int = None, limit: int = None, as_array: bool = False,
+                                  price_scale: int = None):
+        # Send in a new order. as_array returns a numpy structured array, see trades_to_array.
+        endpoint_url, symbol = self.__route(symbol, MARKET_RECENT_TRADES_LIST_URL,
+                                            MARKET_RECENT_TRADES_LIST_BINANCE_URL)
 
         payload = {
             "symbol": symbol,
@@ -140,16 +1888,16 @@ class BaseTokoCrypto:
         }
 
         response = self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=False)
-        return response
+        if as_array:
+            return trades_to_array(response, price_scale)
+        return self.__model(response, Trade)
 
     def market_aggregate_trade_list(self, symbol: str, from_id: int = None, start_time: int = None,
-                                    end_time: int = None, limit: int = None):
-        # Send in a new order.
-        if self.__symbol_type[symbol] == 1:
-            endpoint_url = MARKET_AGGREGATE_TRADE_LIST_BINANCE_URL
-            symbol = symbol.replace("_", "")
-        else:
-            endpoint_url = BASE_URL + MARKET_AGGREGATE_TRADE_LIST_URL
+                                    end_time: int = None, limit: int = None, as_array: bool = False,
+                                    price_scale: int = None):
+        # Send in a new order. as_array returns a numpy structured array, see agg_trades_to_array.
+        endpoint_url, symbol = self.__route(symbol, MARKET_AGGREGATE_TRADE_LIST_URL,
+                                            MARKET_AGGREGATE_TRADE_LIST_BINANCE_URL)
 
         payload = {
             "symbol": symbol,
@@ -160,10 +1908,12 @@ class BaseTokoCrypto:
         }
 
         response = self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=False)
-        return response
+        if as_array:
+            return agg_trades_to_array(response, price_scale)
+        return self.__model(response, AggTrade)
 
     def market_candlestick_data(self, symbol: str, interval: str, start_time: int = None, end_time: int = None,
-                                limit: int = 500):
+                                limit: int = 500, as_array: bool = False, price_scale: int = None):
         # Send in a new order.
         """
         :param symbol:
@@ -172,14 +1922,12 @@ class BaseTokoCrypto:
         :param start_time: If startTime and endTime are not sent, the most recent kline are returned.
         :param end_time: If startTime and endTime are not sent, the most recent kline are returned.
         :param limit:
+        :param as_array: return a numpy structured array (see klines_to_array) instead of the response
+        :param price_scale: with as_array, store prices and volumes as int64 fixed point (value * price_scale)
         :return: response
         """
 
-        if self.__symbol_type[symbol] == 1:
-            endpoint_url = MARKET_CANDLESTICK_DATA_BINANCE_URL
-            symbol = symbol.replace("_", "")
-        else:
-            endpoint_url = BASE_URL + MARKET_CANDLESTICK_DATA_URL
+        endpoint_url, symbol = self.__route(symbol, MARKET_CANDLESTICK_DATA_URL, MARKET_CANDLESTICK_DATA_BINANCE_URL)
 
         payload = {
             "symbol": symbol,
@@ -190,7 +1938,92 @@ class BaseTokoCrypto:
         }
 
         response = self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=False)
-        return response
+        if as_array:
+            return klines_to_array(response, price_scale)
+        return self.__model(response, Kline)
+
+    def market_candlestick_history(self, symbol: str, interval: str, start_time: int, end_time: int = None,
+                                   limit: int = 1000, price_scale: int = None):
+        # Fetch every kline between start_time and end_time page by page into one numpy structured array.
+        pages = []
+        while True:
+            page = self.market_candlestick_data(symbol, interval, start_time=start_time, end_time=end_time,
+                                                limit=limit, as_array=True, price_scale=price_scale)
+            if len(page):
+                pages.append(page)
+            if len(page) < limit:
+                break
+            start_time = int(page["open_time"][-1]) + 1
+            if end_time is not None and start_time > end_time:
+                break
+        if not pages:
+            return np.empty(0, dtype=_dtype(KLINE_FIELDS, price_scale))
+        return np.concatenate(pages)
+
+    def market_local_order_book(self, symbol: str, limit: int = None, book: OrderBook = None) -> OrderBook:
+        # Fetch a depth snapshot into a local OrderBook; an existing book is updated level by level.
+        if book is None:
+            book = OrderBook(symbol)
+        book.apply_snapshot(self.market_order_book(symbol, limit=limit))
+        return book
+
+    def market_batch(self, method: str, symbols: list, max_workers_per_host: int = DEFAULT_FANOUT_WORKERS,
+                     as_completed: bool = False, **params):
+        """
+        Call one market endpoint for many symbols concurrently. Work is grouped by routed host, each host
+        (Tokocrypto, Binance) gets its own bounded worker pool so one cannot starve the other's limits.
+        :param method: market_order_book, market_recent_trades_list, market_aggregate_trade_list or
+        market_candlestick_data
+        :param symbols: symbols, or (symbol, params) tuples whose params override the shared ones
+        :param max_workers_per_host: concurrent requests per host, keep it within the session's pool_maxsize
+        :param as_completed: return an iterator of BatchResult in completion order instead of a dict
+        :param params: arguments shared by every call, e.g. interval="1m" or limit=100
+        :return: dict of symbol -> BatchResult, or an iterator of BatchResult
+        """
+        if method not in MARKET_BATCH_METHODS:
+            raise ValueError("%s is not a batchable market endpoint" % method)
+        func = getattr(self, method)
+
+        groups = dict()
+        failed = []
+        seen = set()
+        for item in symbols:
+            symbol, item_params = (item, params) if isinstance(item, str) else (item[0], {**params, **item[1]})
+            if symbol in seen:
+                raise ValueError("symbol %s is requested more than once" % symbol)
+            seen.add(symbol)
+            try:
+                route, _ = self.__symbols.route(symbol)
+            except KeyError as error:
+                failed.append(BatchResult(symbol, item_params, error=error))
+                continue
+            groups.setdefault(route, []).append((symbol, item_params))
+
+        def call(symbol, item_params):
+            try:
+                return BatchResult(symbol, item_params, response=func(symbol, **item_params))
+            except Exception as error:
+                return BatchResult(symbol, item_params, error=error)
+
+        executors = [ThreadPoolExecutor(max_workers=min(max_workers_per_host, len(group)))
+                     for group in groups.values()]
+        futures = [executor.submit(call, symbol, item_params)
+                   for executor, group in zip(executors, groups.values()) for symbol, item_params in group]
+        for executor in executors:
+            executor.shutdown(wait=False)
+        if as_completed:
+            return self.__iter_batch(failed, futures)
+        results = {result.symbol: result for result in failed}
+        for future in futures:
+            result = future.result()
+            results[result.symbol] = result
+        return results
+
+    @staticmethod
+    def __iter_batch(failed: list, futures: list):
+        yield from failed
+        for future in futures_as_completed(futures):
+            yield future.result()
 
     def account_new_order(self, symbol: str, side: int, type_: int, time_in_force: int = None, quantity: str = None,
                           quote_order_qty: str = None, price: str = None, client_id: str = None, stop_price: str = None,
@@ -230,7 +2063,7 @@ class BaseTokoCrypto:
         """
         endpoint_url = BASE_URL + ACCOUNT_NEW_ORDER_URL
 
-        timestamp = int(time.time() * 1000)
+        timestamp = self.__clock.timestamp()
         payload = {
             "symbol": symbol,
             "side": side,
@@ -247,20 +2080,21 @@ class BaseTokoCrypto:
         }
 
         response = self.__request(method="post", payload=payload, endpoint_url=endpoint_url, signed=True)
-        return response.json()
+        body = self.__decode(response)
+        return to_models(body, Order) if self.__models else body
 
-    def account_query_order(self, order_id: int, client_id: str = None, recv_window: int = 5000):
+    def account_query_order(self, order_id: int = None, client_id: str = None, recv_window: int = 5000):
         # Send in a new order.
         """
         :param order_id: You can check the
         :param client_id: Client's custom ID for the order, Server does not check its uniqueness.
-        Automatically generated if not sent.
+        Automatically generated if not sent. Either order_id or client_id must be sent.
         :param recv_window:
         :return:
         """
         endpoint_url = BASE_URL + ACCOUNT_QUERY_ORDER_URL
 
-        timestamp = int(time.time() * 1000)
+        timestamp = self.__clock.timestamp()
         payload = {
             "orderId": order_id,
             "clientId": client_id,
@@ -269,7 +2103,7 @@ class BaseTokoCrypto:
         }
 
         response = self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=True)
-        return response
+        return self.__model(response, Order)
 
     def account_cancel_order(self, order_id: int, recv_window: int = 5000):
         # Send in a new order.
@@ -279,7 +2113,7 @@ class BaseTokoCrypto:
         """
         endpoint_url = BASE_URL + ACCOUNT_CANCEL_ORDER_URL
 
-        timestamp = int(time.time() * 1000)
+        timestamp = self.__clock.timestamp()
         payload = {
             "orderId": order_id,
             "recvWindow": recv_window,
@@ -287,7 +2121,72 @@ class BaseTokoCrypto:
         }
 
         response = self.__request(method="post", payload=payload, endpoint_url=endpoint_url, signed=True)
-        return response
+        return self.__model(response, Order)
+
+    def account_new_orders(self, orders: list, max_workers: int = DEFAULT_FANOUT_WORKERS,
+                           recv_window: int = 5000) -> BulkOrderResult:
+        """
+        Place many orders at once. Every order is signed up front with a clientId (generated when missing), then
+        sent concurrently through the pooled session within the WeightScheduler budget. With a Resilience policy an
+        order is only resent when it provably never reached the exchange (no connection, 429/418); an order whose
+        outcome is unknown (read timeout, 5xx) is looked up by that clientId and fails with its original error when
+        the exchange does not show it yet, so no order is sent twice. Check those with account_query_order.
+        :param orders: dicts of account_new_order arguments (symbol, side, type_, price, quantity, ...)
+        :param max_workers: orders in flight at once, keep it within the session's pool_maxsize
+        :param recv_window: all orders must be sent within this window after signing
+        :return: BulkOrderResult holding the decoded answer of each order in input order
+        """
+        endpoint_url = BASE_URL + ACCOUNT_NEW_ORDER_URL
+        prepared = []
+        for order in orders:
+            unknown = set(order) - {name for name, _ in ORDER_FIELDS}
+            if unknown:
+                raise TypeError("unexpected order arguments: %s" % ", ".join(sorted(unknown)))
+            payload = {field: order.get(name) for name, field in ORDER_FIELDS}
+            if payload["clientId"] is None:
+                payload["clientId"] = uuid.uuid4().hex
+            payload["recvWindow"] = recv_window
+            payload["timestamp"] = self.__clock.timestamp()
+            plan, url = self.__prepare("post", payload, endpoint_url, True)
+            prepared.append((OrderResult(order, payload["clientId"]), plan, payload, url))
+        return self.__send_bulk(prepared, max_workers, decode=True)
+
+    def account_cancel_orders(self, order_ids: list, max_workers: int = DEFAULT_FANOUT_WORKERS,
+                              recv_window: int = 5000) -> BulkOrderResult:
+        """
+        Cancel many orders at once, signed up front and sent concurrently like account_new_orders.
+        With a Resilience policy a cancel is resent, signed again, only when it provably never reached the exchange
+        (no connection, 429/418); a cancel whose outcome is unknown fails with its original error.
+        :return: BulkOrderResult holding the response of each cancel in input order
+        """
+        endpoint_url = BASE_URL + ACCOUNT_CANCEL_ORDER_URL
+        prepared = []
+        for order_id in order_ids:
+            payload = {
+                "orderId": order_id,
+                "recvWindow": recv_window,
+                "timestamp": self.__clock.timestamp()
+            }
+            plan, url = self.__prepare("post", payload, endpoint_url, True)
+            prepared.append((OrderResult(order_id), plan, payload, url))
+        return self.__send_bulk(prepared, max_workers, decode=False)
+
+    def __send_bulk(self, prepared: list, max_workers: int, decode: bool) -> BulkOrderResult:
+        def send(result, plan, payload, url):
+            started = time.perf_counter()
+            try:
+                response = self.__dispatch(plan, payload, url, self.__headers)
+                result.response = self.__decode(response) if decode else response
+            except Exception as error:
+                result.error = error
+            result.latency = time.perf_counter() - started
+
+        started = time.perf_counter()
+        if prepared:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(prepared))) as executor:
+                for item in prepared:
+                    executor.submit(send, *item)
+        return BulkOrderResult([item[0] for item in prepared], time.perf_counter() - started)
 
     def account_all_order(self, symbol: str, side: int = None, type_: int = None, start_time: int = None,
                           end_time: int = None, from_id: str = None, direct: int = None, limit: int = None,
@@ -318,7 +2217,7 @@ class BaseTokoCrypto:
         """
         endpoint_url = BASE_URL + ACCOUNT_ALL_ORDER
 
-        timestamp = int(time.time() * 1000)
+        timestamp = self.__clock.timestamp()
         payload = {
             "symbol": symbol,
             "type": type_,
@@ -333,7 +2232,7 @@ class BaseTokoCrypto:
         }
 
         response = self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=True)
-        return response
+        return self.__model(response, Order)
 
     def account_new_oco(self, symbol: str, side: int, quantity: str, price: str, stop_client_id: str = None,
                         stop_price: str = None, list_client_d: str = None, limit_client_id: str = None,
@@ -357,42 +2256,42 @@ class BaseTokoCrypto:
         # Send in a new OCO
         endpoint_url = BASE_URL + ACCOUNT_NEW_OCO
 
-        timestamp = int(time.time() * 1000)
+        timestamp = self.__clock.timestamp()
         payload = {
             "symbol": symbol,
             "listClientId": list_client_d,
             "side": side,
             "quantity": quantity,
-            "limitClientId	": limit_client_id,
+            "limitClientId": limit_client_id,
             "price": price,
             "stopClientId": stop_client_id,
             "stopPrice": stop_price,
-            "stopLimitPrice	": stop_limit_price,
+            "stopLimitPrice": stop_limit_price,
             "recvWindow": recv_window,
             "timestamp": timestamp
         }
 
         response = self.__request(method="post", payload=payload, endpoint_url=endpoint_url, signed=True)
-        return response
+        return self.__model(response, OrderList)
 
     def account_information(self, recv_window: int = 5000):
         # Get current account information.
         endpoint_url = BASE_URL + ACCOUNT_INFORMATION_URL
 
-        timestamp = int(time.time() * 1000)
+        timestamp = self.__clock.timestamp()
         payload = {
             "recvWindow": recv_window,
             "timestamp": timestamp
         }
 
         response = self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=True)
-        return response
+        return self.__model(response, Balance, ("accountAssets", "balances"))
 
     def account_asset_information(self, asset: str, recv_window: int = 5000):
         # Get current account information for a specific asset.
         endpoint_url = BASE_URL + ACCOUNT_ASSET_INFORMATION_URL
 
-        timestamp = int(time.time() * 1000)
+        timestamp = self.__clock.timestamp()
         payload = {
             "asset": asset,
             "recvWindow": recv_window,
@@ -400,7 +2299,7 @@ class BaseTokoCrypto:
         }
 
         response = self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=True)
-        return response
+        return self.__model(response, Balance)
 
     def account_trade_list(self, symbol: str, order_id: str = None, start_time: int = None, end_time: int = None,
                            from_id: int = None, direct: int = None, rebate_status: int = None, limit: int = 500,
@@ -408,7 +2307,7 @@ class BaseTokoCrypto:
         # Get trades for a specific account and symbol.
         endpoint_url = BASE_URL + ACCOUNT_TRADE_LIST_URL
 
-        timestamp = int(time.time() * 1000)
+        timestamp = self.__clock.timestamp()
         payload = {
             "asset": symbol,
             "orderId": order_id,
@@ -423,14 +2322,14 @@ class BaseTokoCrypto:
         }
 
         response = self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=True)
-        return response
+        return self.__model(response, AccountTrade)
 
     def wallet_withdraw(self, asset: str, address: str, amount: str, client_id: str = None, network: str = None,
                         address_tag: str = None, recv_window: int = 5000):
         # Submit a withdrawal request.
         endpoint_url = BASE_URL + WALLET_WITHDRAW_URL
 
-        timestamp = int(time.time() * 1000)
+        timestamp = self.__clock.timestamp()
         payload = {
             "asset": asset,
             "clientId": client_id,
@@ -442,15 +2341,16 @@ class BaseTokoCrypto:
             "timestamp": timestamp
         }
 
-        response = self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=True)
-        return response.json()
+        response = self.__request(method="post", payload=payload, endpoint_url=endpoint_url, signed=True)
+        body = self.__decode(response)
+        return to_models(body, Withdrawal) if self.__models else body
 
     def wallet_withdraw_history(self, asset: str = None, status: int = None, from_id: int = None,
                                 start_time: int = None, end_time: int = None, recv_window: int = 5000):
         # Fetch withdraw history.
         endpoint_url = BASE_URL + WALLET_WITHDRAW_HISTORY_URL
 
-        timestamp = int(time.time() * 1000)
+        timestamp = self.__clock.timestamp()
         payload = {
             "asset": asset,
             "status": status,
@@ -462,14 +2362,14 @@ class BaseTokoCrypto:
         }
 
         response = self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=True)
-        return response
+        return self.__model(response, Withdrawal)
 
     def wallet_deposit_history(self, asset: str = None, status: int = None, from_id: int = None, start_time: int = None,
                                end_time: int = None, recv_window: int = 5000):
         # Fetch deposit history..
         endpoint_url = BASE_URL + WALLET_DEPOSIT_HISTORY_URL
 
-        timestamp = int(time.time() * 1000)
+        timestamp = self.__clock.timestamp()
         payload = {
             "asset": asset,
             "status": status,
@@ -481,13 +2381,13 @@ class BaseTokoCrypto:
         }
 
         response = self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=True)
-        return response
+        return self.__model(response, Deposit)
 
     def wallet_deposit_address(self, asset: str, network: str, recv_window: int = 5000):
         # Fetch deposit address.
         endpoint_url = BASE_URL + WALLET_DEPOSIT_ADDRESS_URL
 
-        timestamp = int(time.time() * 1000)
+        timestamp = self.__clock.timestamp()
         payload = {
             "asset": asset,
             "network": network,
@@ -496,7 +2396,46 @@ class BaseTokoCrypto:
         }
 
         response = self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=True)
-        return response
+        return self.__model(response, DepositAddress)
+
+    def iter_account_all_order(self, symbol: str, side: int = None, type_: int = None, start_time: int = None,
+                               end_time: int = None, direct: int = None, limit: int = 1000, recv_window: int = 5000,
+                               cursor: str = None) -> PageIterator:
+        # Iterate over all account orders across pages, see account_all_order. Resume with cursor=iterator.cursor.
+        def fetch_page(from_id):
+            return _page_rows(self.account_all_order(symbol, side=side, type_=type_, start_time=start_time,
+                                                     end_time=end_time, from_id=from_id, direct=direct, limit=limit,
+                                                     recv_window=recv_window))
+        return PageIterator(fetch_page, "orderId", cursor=cursor, page_size=limit)
+
+    def iter_account_trade_list(self, symbol: str, order_id: str = None, start_time: int = None, end_time: int = None,
+                                direct: int = None, rebate_status: int = None, limit: int = 1000,
+                                recv_window: int = 5000, cursor: int = None) -> PageIterator:
+        # Iterate over account trades across pages, see account_trade_list. Resume with cursor=iterator.cursor.
+        def fetch_page(from_id):
+            return _page_rows(self.account_trade_list(symbol, order_id=order_id, start_time=start_time,
+                                                      end_time=end_time, from_id=from_id, direct=direct,
+                                                      rebate_status=rebate_status, limit=limit,
+                                                      recv_window=recv_window))
+        return PageIterator(fetch_page, "tradeId", cursor=cursor, page_size=limit)
+
+    def iter_wallet_withdraw_history(self, asset: str = None, status: int = None, start_time: int = None,
+                                     end_time: int = None, recv_window: int = 5000, cursor: int = None) -> PageIterator:
+        # Iterate over withdraw history across pages, see wallet_withdraw_history. Resume with cursor=iterator.cursor.
+        def fetch_page(from_id):
+            return _page_rows(self.wallet_withdraw_history(asset=asset, status=status, from_id=from_id,
+                                                           start_time=start_time, end_time=end_time,
+                                                           recv_window=recv_window))
+        return PageIterator(fetch_page, "id", cursor=cursor)
+
+    def iter_wallet_deposit_history(self, asset: str = None, status: int = None, start_time: int = None,
+                                    end_time: int = None, recv_window: int = 5000, cursor: int = None) -> PageIterator:
+        # Iterate over deposit history across pages, see wallet_deposit_history. Resume with cursor=iterator.cursor.
+        def fetch_page(from_id):
+            return _page_rows(self.wallet_deposit_history(asset=asset, status=status, from_id=from_id,
+                                                          start_time=start_time, end_time=end_time,
+                                                          recv_window=recv_window))
+        return PageIterator(fetch_page, "id", cursor=cursor)
 
     @property
     def api_key(self) -> str:
@@ -505,6 +2444,7 @@ class BaseTokoCrypto:
     @api_key.setter
     def api_key(self, api_key: str):
         self.__api_key = api_key
+        self.__headers = {"X-MBX-APIKEY": api_key}
 
     @property
     def secret_key(self) -> str:
@@ -512,8 +2452,1142 @@ class BaseTokoCrypto:
 
     @secret_key.setter
     def secret_key(self, secret_key: str):
-        self.__api_key = secret_key
+        self.__secret_key = secret_key
+        self.__signer = _Signer(secret_key) if secret_key is not None else None
+
+    @property
+    def session(self) -> requests.Session:
+        return self.__session
+
+    @property
+    def symbols(self) -> SymbolIndex:
+        return self.__symbols
+
+    @property
+    def scheduler(self) -> WeightScheduler:
+        return self.__scheduler
+
+    @property
+    def clock(self) -> ClockSync:
+        return self.__clock
+
+    @property
+    def cache(self) -> ResponseCache:
+        return self.__cache
+
+    @property
+    def metrics(self) -> Metrics:
+        return self.__metrics
+
+    @property
+    def resilience(self) -> Resilience:
+        return self.__resilience
 
     @property
     def symbol_type(self) -> dict:
-        return self.__symbol_type
+        # fetched on first access like the eager table of previous versions
+        if not self.__symbols.symbol_type and self.__symbols.claim_refresh():
+            self.__symbols.refresh()
+        return self.__symbols.symbol_type
+
+
+class KlineStore:
+    """
+    Local kline store keyed by (symbol, interval). Closed candles are kept in an append-only file of fixed-size
+    KLINE_FIELDS records sorted by open_time, next to a json list of the time ranges already synced. sync() only
+    downloads what is missing and read() serves ranges as zero-copy views of a memory map, so reads work offline.
+    A store directory must have a single writer.
+    """
+    def __init__(self, client: BaseTokoCrypto = None, root: str = KLINE_STORE_PATH):
+        """
+        :param client: client used by sync(), not needed to read
+        :param root: directory holding one sub directory per symbol and interval
+        """
+        _require_numpy()
+        self.client = client
+        self.__root = root
+        self.__dtype = _dtype(KLINE_FIELDS)
+
+    def __paths(self, symbol: str, interval: str):
+        if interval not in INTERVAL_MILLISECONDS:
+            raise ValueError("interval %s has no fixed length and cannot be stored" % interval)
+        directory = os.path.join(self.__root, symbol, interval)
+        return directory, os.path.join(directory, "klines.bin"), os.path.join(directory, "ranges.json")
+
+    def ranges(self, symbol: str, interval: str) -> list:
+        # Synced [start, end) open_time ranges in milliseconds.
+        _, _, ranges_path = self.__paths(symbol, interval)
+        try:
+            with open(ranges_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def read(self, symbol: str, interval: str, start_time: int = None, end_time: int = None):
+        # Klines with start_time <= open_time < end_time as a read-only view of the memory-mapped file.
+        _, data_path, _ = self.__paths(symbol, interval)
+        try:
+            size = os.path.getsize(data_path)
+        except OSError:
+            size = 0
+        if size < self.__dtype.itemsize:
+            return np.empty(0, dtype=self.__dtype)
+        klines = np.memmap(data_path, dtype=self.__dtype, mode="r", shape=(size // self.__dtype.itemsize,))
+        open_time = klines["open_time"]
+        start = 0 if start_time is None else int(np.searchsorted(open_time, start_time, "left"))
+        end = len(klines) if end_time is None else int(np.searchsorted(open_time, end_time, "left"))
+        return klines[start:end]
+
+    def missing(self, symbol: str, interval: str, start_time: int, end_time: int) -> list:
+        # [start, end) ranges between start_time and end_time that were never synced.
+        missing, cursor = [], start_time
+        for range_start, range_end in self.ranges(symbol, interval):
+            if range_end <= cursor:
+                continue
+            if range_start >= end_time:
+                break
+            if range_start > cursor:
+                missing.append([cursor, range_start])
+            cursor = max(cursor, range_end)
+        if cursor < end_time:
+            missing.append([cursor, end_time])
+        return missing
+
+    def gaps(self, symbol: str, interval: str) -> list:
+        # [start, end) ranges inside the stored data without candles (exchange downtime or interrupted syncs).
+        open_time = self.read(symbol, interval)["open_time"]
+        step = INTERVAL_MILLISECONDS[interval]
+        holes = np.nonzero(np.diff(open_time) > step)[0]
+        return [[int(open_time[i]) + step, int(open_time[i + 1])] for i in holes]
+
+    def sync(self, symbol: str, interval: str, start_time: int, end_time: int = None) -> int:
+        """
+        Download the closed candles between start_time and end_time (default: now) that are not stored yet.
+        :return: number of klines added
+        """
+        step = INTERVAL_MILLISECONDS[interval]
+        start_time = start_time // step * step
+        closed = int(time.time() * 1000) // step * step
+        end_time = closed if end_time is None else min(end_time, closed)
+        added = 0
+        for range_start, range_end in self.missing(symbol, interval, start_time, end_time):
+            klines = self.client.market_candlestick_history(symbol, interval, range_start, end_time=range_end - 1)
+            klines = klines[(klines["open_time"] >= range_start) & (klines["open_time"] < range_end)]
+            added += self.__write(symbol, interval, klines)
+            self.__add_range(symbol, interval, range_start, range_end)
+        return added
+
+    def __write(self, symbol: str, interval: str, klines) -> int:
+        directory, data_path, _ = self.__paths(symbol, interval)
+        if not len(klines):
+            return 0
+        os.makedirs(directory, exist_ok=True)
+        stored = self.read(symbol, interval)
+        if not len(stored) or klines["open_time"][0] > stored["open_time"][-1]:
+            # the usual case, newer candles: append in place
+            with open(data_path, "ab") as f:
+                f.write(np.ascontiguousarray(klines, dtype=self.__dtype).tobytes())
+            return len(klines)
+        # backfill: merge and swap the file
+        merged = np.concatenate([np.asarray(stored), klines.astype(self.__dtype)])
+        merged = merged[np.unique(merged["open_time"], return_index=True)[1]]
+        del stored
+        tmp_path = data_path + ".tmp"
+        merged.tofile(tmp_path)
+        os.replace(tmp_path, data_path)
+        return len(klines)
+
+    def __add_range(self, symbol: str, interval: str, start_time: int, end_time: int):
+        ranges = sorted(self.ranges(symbol, interval) + [[start_time, end_time]])
+        merged = [ranges[0]]
+        for range_start, range_end in ranges[1:]:
+            if range_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], range_end)
+            else:
+                merged.append([range_start, range_end])
+        _, _, ranges_path = self.__paths(symbol, interval)
+        tmp_path = ranges_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(merged, f)
+        os.replace(tmp_path, ranges_path)
+
+
+class AggTradeDownloader:
+    """
+    Bulk, resumable download of market_aggregate_trade_list. The requested time range is cut into shards of
+    shard_length milliseconds per symbol, shards run on a thread pool and each one is written to its own compressed
+    partition (<root>/<symbol>/<shard start>.npz, AGG_TRADE_FIELDS columns). A shard holds the trades with
+    start <= time < end, so consecutive shards stitch by agg_id without overlap. Downloaded shards are recorded in
+    <root>/<symbol>/checkpoint.json with the end they reached, a rerun of download() skips them. A shard cut short by
+    end_time or by now is downloaded again in full once a later run asks for more of it.
+    Requests go through the client, give it a WeightScheduler to keep the pool inside the rate budget.
+    """
+    def __init__(self, client: BaseTokoCrypto = None, root: str = AGG_TRADE_STORE_PATH,
+                 shard_length: int = AGG_TRADE_SHARD, max_workers: int = DEFAULT_FANOUT_WORKERS,
+                 page_size: int = AGG_TRADE_PAGE_SIZE):
+        """
+        :param client: client used by download(), not needed to read
+        :param root: directory holding one sub directory per symbol
+        :param shard_length: milliseconds per shard and partition file
+        :param max_workers: shards downloaded at the same time
+        :param page_size: trades per request
+        """
+        _require_numpy()
+        self.client = client
+        self.__root = root
+        self.__shard_length = shard_length
+        self.__max_workers = max_workers
+        self.__page_size = page_size
+        self.__dtype = _dtype(AGG_TRADE_FIELDS)
+
+    def __checkpoint_path(self, symbol: str) -> str:
+        return os.path.join(self.__root, symbol, "checkpoint.json")
+
+    def checkpoint(self, symbol: str) -> dict:
+        # Finished shards: partition name -> {"start", "end", "first_id", "last_id", "count"}.
+        try:
+            with open(self.__checkpoint_path(symbol)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def __save_checkpoint(self, symbol: str, checkpoint: dict):
+        path = self.__checkpoint_path(symbol)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def __partition(start: int) -> str:
+        return datetime.fromtimestamp(start / 1000, timezone.utc).strftime("%Y-%m-%dT%H%M%S")
+
+    def shards(self, symbol: str, start_time: int, end_time: int) -> list:
+        # [start, end) shards between start_time and end_time not downloaded that far yet, the last one ends at
+        # end_time.
+        done = self.checkpoint(symbol)
+        start = start_time // self.__shard_length * self.__shard_length
+        shards = []
+        while start < end_time:
+            end = min(start + self.__shard_length, end_time)
+            entry = done.get(self.__partition(start))
+            if entry is None or entry["end"] < end:
+                shards.append([start, end])
+            start += self.__shard_length
+        return shards
+
+    def download(self, symbols: list, start_time: int, end_time: int = None) -> dict:
+        """
+        Download every missing shard of symbols between start_time and end_time (default: now, a later end_time is
+        cut to now).
+        :return: {symbol: number of trades written}
+        """
+        now = int(time.time() * 1000)
+        end_time = now if end_time is None else min(end_time, now)
+        written = dict.fromkeys(symbols, 0)
+        checkpoints = {symbol: self.checkpoint(symbol) for symbol in symbols}
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+            futures = dict()
+            for symbol in symbols:
+                os.makedirs(os.path.join(self.__root, symbol), exist_ok=True)
+                for start, end in self.shards(symbol, start_time, end_time):
+                    futures[executor.submit(self.__download_shard, symbol, start, end)] = (symbol, start, end)
+            for future in futures_as_completed(futures):
+                symbol, start, end = futures[future]
+                try:
+                    entry = future.result()
+                except Exception as error:
+                    errors.append(error)
+                    continue
+                written[symbol] += entry["count"]
+                checkpoints[symbol][self.__partition(start)] = entry
+                self.__save_checkpoint(symbol, checkpoints[symbol])
+        if errors:
+            raise errors[0]
+        return written
+
+    def __fetch(self, symbol: str, **kwargs):
+        return self.client.market_aggregate_trade_list(symbol, limit=self.__page_size, as_array=True, **kwargs)
+
+    def __download_shard(self, symbol: str, start: int, end: int) -> dict:
+        # Find the first trade with time windows, then walk by fromId until the shard ends.
+        pages, from_id, cursor = [], None, start
+        while True:
+            if from_id is None:
+                if cursor >= end:
+                    break
+                page = self.__fetch(symbol, start_time=cursor, end_time=min(cursor + AGG_TRADE_WINDOW, end) - 1)
+                cursor += AGG_TRADE_WINDOW
+                if not len(page):
+                    continue
+            else:
+                page = self.__fetch(symbol, from_id=from_id)
+            inside = page[page["time"] < end]
+            pages.append(inside)
+            if len(inside) < len(page) or (from_id is not None and len(page) < self.__page_size):
+                break
+            from_id = int(page["agg_id"][-1]) + 1
+        trades = np.concatenate(pages).astype(self.__dtype) if pages else np.empty(0, dtype=self.__dtype)
+        trades = trades[np.unique(trades["agg_id"], return_index=True)[1]]
+        path = os.path.join(self.__root, symbol, self.__partition(start) + ".npz")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, trades=trades)
+        os.replace(tmp_path, path)
+        return {
+            "start": start,
+            "end": end,
+            "first_id": int(trades["agg_id"][0]) if len(trades) else None,
+            "last_id": int(trades["agg_id"][-1]) if len(trades) else None,
+            "count": len(trades)
+        }
+
+    def read(self, symbol: str, start_time: int = None, end_time: int = None):
+        # Downloaded trades with start_time <= time < end_time, stitched in agg_id order.
+        parts = []
+        for name, entry in sorted(self.checkpoint(symbol).items(), key=lambda item: item[1]["start"]):
+            if (end_time is not None and entry["start"] >= end_time) or \
+                    (start_time is not None and entry["end"] <= start_time) or not entry["count"]:
+                continue
+            with np.load(os.path.join(self.__root, symbol, name + ".npz")) as partition:
+                parts.append(partition["trades"])
+        if not parts:
+            return np.empty(0, dtype=self.__dtype)
+        trades = np.concatenate(parts)
+        mask = np.ones(len(trades), dtype=bool)
+        if start_time is not None:
+            mask &= trades["time"] >= start_time
+        if end_time is not None:
+            mask &= trades["time"] < end_time
+        return trades[mask]
+
+    def gaps(self, symbol: str) -> list:
+        # [last_id, first_id] pairs of consecutive non-empty shards whose agg ids do not join up.
+        entries = sorted((entry for entry in self.checkpoint(symbol).values() if entry["count"]),
+                         key=lambda entry: entry["start"])
+        return [[previous["last_id"], entry["first_id"]] for previous, entry in zip(entries, entries[1:])
+                if entry["first_id"] != previous["last_id"] + 1]
+
+
+def _body_data(body):
+    # decoded answer or Response, unwrapped from Tokocrypto's {"code": 0, "data": ...}
+    if hasattr(body, "json"):
+        body = body.json()
+    return body["data"] if isinstance(body, dict) and "data" in body else body
+
+
+class AccountState:
+    """
+    Local mirror of balances and open orders so risk checks do not poll account_information before every order.
+    Seeded from account_information and account_all_order, updated from order, cancel and OCO answers and from
+    fills, and reconciled with the exchange by a background thread. Queries only read memory.
+    Balances of orders with a known price (limit orders) are locked locally until the order is filled or canceled;
+    market orders are only reflected after the next reconcile.
+    The first reconcile walks each symbol's whole order history; later ones only walk the orders created since the
+    oldest order the previous reconcile found open, or since the previous reconcile started when none was.
+    """
+    def __init__(self, client: BaseTokoCrypto, symbols: list, reconcile_interval: float = ACCOUNT_RECONCILE_INTERVAL):
+        """
+        :param client: client used for seeding, reconciling and the new_order / cancel_order / new_oco helpers
+        :param symbols: symbols whose open orders are tracked, e.g. ["BTC_USDT"]
+        :param reconcile_interval: seconds between background reconciles, None to reconcile only on demand
+        """
+        self.client = client
+        self.symbols = list(symbols)
+        self.__reconcile_interval = reconcile_interval
+        self.__lock = threading.Lock()
+        self.__balances = dict()
+        self.__orders = dict()
+        self.__journal = None
+        self.__start_times = dict()
+        self.__thread = None
+        self.__stop = threading.Event()
+        self.last_reconcile = None
+        self.last_error = None
+
+    def reconcile(self):
+        # Replace the mirror with the exchange's balances and open orders. Orders and fills applied while the
+        # snapshot is fetched are journaled and replayed on top of it.
+        with self.__lock:
+            self.__journal = []
+        started = self.client.clock.timestamp()
+        try:
+            account = _body_data(self.client.account_information())
+            balances = dict()
+            for row in account.get("accountAssets", account.get("balances", [])):
+                balances[row["asset"]] = [float(row["free"]), float(row["locked"])]
+            orders = dict()
+            start_times = dict()
+            for symbol in self.symbols:
+                # an order open now was open at the previous reconcile or created since it started
+                start_time = self.__start_times.get(symbol)
+                pages = self.client.iter_account_all_order(symbol, start_time=start_time)
+                oldest = started
+                try:
+                    for row in pages:
+                        if row.get("status") in OPEN_ORDER_STATUSES:
+                            order = self.__order(row)
+                            orders[order["orderId"]] = order
+                            if oldest is not None:
+                                oldest = min(oldest, int(row["createTime"])) if row.get("createTime") else None
+                finally:
+                    pages.close()
+                if oldest is not None:
+                    start_times[symbol] = oldest - ACCOUNT_RECONCILE_OVERLAP * 1000
+        except Exception:
+            with self.__lock:
+                self.__journal = None
+            raise
+        with self.__lock:
+            journal, self.__journal = self.__journal, None
+            self.__balances = balances
+            self.__orders = orders
+            for kind, args in journal:
+                if kind == "order":
+                    self.__apply_order(*args)
+                else:
+                    self.__replay_fill(*args)
+            self.__start_times = start_times
+        self.last_reconcile = time.time()
+
+    def start(self):
+        # Seed now, then reconcile in the background every reconcile_interval seconds.
+        self.reconcile()
+        if self.__reconcile_interval and self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run, name="pytokocrypto-account", daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+
+    def __run(self):
+        while not self.__stop.wait(self.__reconcile_interval):
+            try:
+                self.reconcile()
+                self.last_error = None
+            except Exception as error:
+                self.last_error = error
+
+    @staticmethod
+    def __order(row: dict) -> dict:
+        symbol = row["symbol"]
+        side = row.get("side")
+        side = SIDE_BUY if side in (SIDE_BUY, "BUY") else SIDE_SELL
+        base, _, quote = symbol.partition("_")
+        price = float(row.get("price") or 0)
+        remaining = float(row.get("origQty") or 0) - float(row.get("executedQty") or 0)
+        # funds this order keeps locked: quote for a limit buy, base for a sell
+        if side == SIDE_BUY:
+            reserved_asset, reserved = quote, remaining * price
+        else:
+            reserved_asset, reserved = base, remaining
+        return {
+            "orderId": row["orderId"],
+            "clientId": row.get("clientId"),
+            "symbol": symbol,
+            "side": side,
+            "price": price,
+            "origQty": float(row.get("origQty") or 0),
+            "executedQty": float(row.get("executedQty") or 0),
+            "status": row.get("status"),
+            "base": base,
+            "quote": quote,
+            "reservedAsset": reserved_asset,
+            "reserved": reserved
+        }
+
+    def __move(self, asset: str, free: float, locked: float):
+        # caller holds the lock
+        balance = self.__balances.setdefault(asset, [0.0, 0.0])
+        balance[0] += free
+        balance[1] += locked
+
+    def apply_order(self, response) -> dict:
+        # Apply an account_new_order / account_query_order / account_cancel_order answer.
+        row = _body_data(response)
+        order = self.__order(row)
+        with self.__lock:
+            if self.__journal is not None:
+                self.__journal.append(("order", (dict(order),)))
+            self.__apply_order(order)
+        return order
+
+    def __apply_order(self, order: dict):
+        # caller holds the lock; idempotent, so a replayed order the snapshot already holds changes nothing
+        known = self.__orders.get(order["orderId"])
+        if known is None:
+            if order["status"] in OPEN_ORDER_STATUSES:
+                if order["reserved"]:
+                    self.__move(order["reservedAsset"], -order["reserved"], order["reserved"])
+                self.__orders[order["orderId"]] = order
+            return
+        if order["status"] in CLOSED_ORDER_STATUSES:
+            del self.__orders[order["orderId"]]
+            if known["reserved"]:
+                self.__move(known["reservedAsset"], known["reserved"], -known["reserved"])
+        else:
+            known["status"] = order["status"]
+
+    def apply_oco(self, response) -> list:
+        # Apply an account_new_oco answer, both legs of the list are tracked.
+        data = _body_data(response)
+        legs = data.get("orderReports") or data.get("orders") or []
+        return [self.apply_order(leg) for leg in legs if "symbol" in leg]
+
+    def apply_fill(self, order_id, quantity: float, price: float, fee: float = 0.0, fee_asset: str = None):
+        # Apply a fill of a tracked order: release its lock and move base and quote balances.
+        quantity, price, fee = float(quantity), float(price), float(fee or 0.0)
+        with self.__lock:
+            order = self.__orders.get(order_id)
+            if order is None:
+                return
+            self.__apply_fill(order, quantity, price, fee, fee_asset)
+            if self.__journal is not None:
+                self.__journal.append(("fill", (order_id, quantity, price, fee, fee_asset, order["executedQty"])))
+
+    def __replay_fill(self, order_id, quantity: float, price: float, fee: float, fee_asset: str, executed: float):
+        # caller holds the lock; only the part of the fill the snapshot does not show yet is applied again
+        order = self.__orders.get(order_id)
+        if order is None or order["executedQty"] >= executed:
+            return
+        missing = min(quantity, executed - order["executedQty"])
+        self.__apply_fill(order, missing, price, fee * missing / quantity if quantity else 0.0, fee_asset)
+
+    def __apply_fill(self, order: dict, quantity: float, price: float, fee: float, fee_asset: str):
+        # caller holds the lock
+        order["executedQty"] += quantity
+        released = quantity * order["price"] if order["side"] == SIDE_BUY else quantity
+        released = min(released, order["reserved"])
+        order["reserved"] -= released
+        self.__move(order["reservedAsset"], 0.0, -released)
+        if order["side"] == SIDE_BUY:
+            self.__move(order["quote"], released - quantity * price, 0.0)
+            self.__move(order["base"], quantity, 0.0)
+        else:
+            self.__move(order["quote"], quantity * price, 0.0)
+        if fee and fee_asset:
+            self.__move(fee_asset, -fee, 0.0)
+        if order["executedQty"] >= order["origQty"]:
+            del self.__orders[order["orderId"]]
+            if order["reserved"]:
+                self.__move(order["reservedAsset"], order["reserved"], -order["reserved"])
+
+    def new_order(self, **kwargs) -> dict:
+        # account_new_order, then apply its answer
+        response = self.client.account_new_order(**kwargs)
+        self.apply_order(response)
+        return response
+
+    def cancel_order(self, order_id: int, **kwargs):
+        # account_cancel_order, then apply its answer
+        response = self.client.account_cancel_order(order_id, **kwargs)
+        body = _body_data(response)
+        with self.__lock:
+            known = self.__orders.get(order_id)
+        if "symbol" not in body:
+            if known is None:
+                return response  # untracked, and the answer does not say which symbol to apply it to
+            body = {**known, "status": 3}
+        self.apply_order({"data": {**body, "status": body.get("status", 3)}})
+        return response
+
+    def new_oco(self, **kwargs):
+        # account_new_oco, then apply its answer
+        response = self.client.account_new_oco(**kwargs)
+        self.apply_oco(response)
+        return response
+
+    def free(self, asset: str) -> float:
+        balance = self.__balances.get(asset)
+        return balance[0] if balance is not None else 0.0
+
+    def locked(self, asset: str) -> float:
+        balance = self.__balances.get(asset)
+        return balance[1] if balance is not None else 0.0
+
+    def balances(self) -> dict:
+        with self.__lock:
+            return {asset: tuple(balance) for asset, balance in self.__balances.items()}
+
+    def open_orders(self, symbol: str = None) -> list:
+        with self.__lock:
+            return [dict(order) for order in self.__orders.values() if symbol is None or order["symbol"] == symbol]
+
+    def order(self, order_id) -> dict:
+        order = self.__orders.get(order_id)
+        return dict(order) if order is not None else None
+
+
+class StreamUpdate:
+    # One parsed stream message; book is the maintained OrderBook of depth subscriptions, else None.
+    __slots__ = ("kind", "symbol", "data", "book")
+
+    def __init__(self, kind: str, symbol: str, data: dict, book: OrderBook = None):
+        self.kind = kind
+        self.symbol = symbol
+        self.data = data
+        self.book = book
+
+    def __repr__(self):
+        return "StreamUpdate(kind=%r, symbol=%r)" % (self.kind, self.symbol)
+
+
+class _StreamSubscription:
+    __slots__ = ("kind", "symbol", "name", "route", "callback", "book", "depth_limit", "buffer", "resyncing")
+
+    def __init__(self, kind: str, symbol: str, name: str, route: int, callback, book: OrderBook, depth_limit: int):
+        self.kind = kind
+        self.symbol = symbol
+        self.name = name
+        self.route = route
+        self.callback = callback
+        self.book = book
+        self.depth_limit = depth_limit
+        self.buffer = None
+        self.resyncing = False
+
+
+class _StreamConnection:
+    __slots__ = ("route", "names", "task", "websocket")
+
+    def __init__(self, route: int):
+        self.route = route
+        self.names = []
+        self.task = None
+        self.websocket = None
+
+
+class MarketStream:
+    """
+    WebSocket market data subscriber for depth, trades and klines, replacing REST polling. Symbols are routed to the
+    Tokocrypto or Binance stream host like the REST calls, many streams share one combined-stream connection, and
+    dropped connections are reopened with backoff. Depth subscriptions maintain an OrderBook that is resynced from
+    a market_order_book snapshot after every (re)connect or sequence gap.
+    Updates are delivered to per-subscription callbacks (functions or coroutine functions) and through
+    `async for update in stream`. A raising callback does not affect the connection: the error is kept in
+    last_error and counted in callback_errors. Connection and snapshot errors are kept in last_error too.
+
+        client = BaseTokoCrypto()
+        async with MarketStream(client) as stream:
+            stream.subscribe_depth("BTC_USDT")
+            async for update in stream:
+                print(update.book.best_bid())
+    """
+    def __init__(self, client: BaseTokoCrypto = None, symbols: SymbolIndex = None, urls: dict = None,
+                 max_streams_per_connection: int = STREAM_MAX_PER_CONNECTION,
+                 reconnect_delay: float = STREAM_RECONNECT_DELAY,
+                 max_reconnect_delay: float = STREAM_MAX_RECONNECT_DELAY, queue_size: int = STREAM_QUEUE_SIZE):
+        """
+        :param client: client used for routing and depth snapshots
+        :param symbols: SymbolIndex used for routing, defaults to the client's
+        :param urls: stream url by route (ROUTE_TOKOCRYPTO, ROUTE_BINANCE), e.g. a local test server
+        :param max_streams_per_connection: streams multiplexed on one connection
+        :param reconnect_delay: first delay before reconnecting, doubled up to max_reconnect_delay
+        :param max_reconnect_delay:
+        :param queue_size: updates buffered for async iteration, the oldest are dropped when full
+        """
+        if websockets is None:
+            raise ImportError("MarketStream requires websockets, install it with `pip install websockets`")
+        self.__client = client
+        self.__symbols = symbols if symbols is not None else client.symbols
+        self.__urls = {ROUTE_TOKOCRYPTO: STREAM_URL, ROUTE_BINANCE: STREAM_BINANCE_URL, **(urls or {})}
+        self.__max_streams = max_streams_per_connection
+        self.__reconnect_delay = reconnect_delay
+        self.__max_reconnect_delay = max_reconnect_delay
+        self.__queue = asyncio.Queue(maxsize=queue_size)
+        self.__subscriptions = dict()
+        self.__connections = []
+        self.__request_id = itertools.count(1)
+        self.__running = False
+        self.last_error = None
+        self.callback_errors = 0
+        self.connects = 0
+
+    def subscribe_depth(self, symbol: str, speed: str = "100ms", callback=None, book: bool = True,
+                        limit: int = 1000) -> OrderBook:
+        # Diff depth stream; with book a local OrderBook is maintained and returned.
+        order_book = OrderBook(symbol) if book else None
+        self.__subscribe("depth", symbol, "depth@" + speed, callback, order_book, limit)
+        return order_book
+
+    def subscribe_trades(self, symbol: str, callback=None):
+        self.__subscribe("trade", symbol, "trade", callback)
+
+    def subscribe_klines(self, symbol: str, interval: str, callback=None):
+        self.__subscribe("kline", symbol, "kline_" + interval, callback)
+
+    def __subscribe(self, kind: str, symbol: str, channel: str, callback, book: OrderBook = None,
+                    depth_limit: int = None):
+        route, market_symbol = self.__symbols.route(symbol)
+        name = market_symbol.replace("_", "").lower() + "@" + channel
+        subscription = _StreamSubscription(kind, symbol, name, route, callback, book, depth_limit)
+        self.__subscriptions[name] = subscription
+        if book is not None:
+            subscription.buffer = []
+        connection = next((connection for connection in self.__connections
+                           if connection.route == route and len(connection.names) < self.__max_streams), None)
+        if connection is None:
+            connection = _StreamConnection(route)
+            self.__connections.append(connection)
+        connection.names.append(name)
+        if self.__running:
+            if connection.task is None:
+                connection.task = asyncio.ensure_future(self.__run(connection))
+            elif connection.websocket is not None:
+                asyncio.ensure_future(self.__send_subscribe(connection, subscription))
+
+    async def __send_subscribe(self, connection: _StreamConnection, subscription: _StreamSubscription):
+        message = {"method": "SUBSCRIBE", "params": [subscription.name], "id": next(self.__request_id)}
+        await connection.websocket.send(json.dumps(message))
+        if subscription.book is not None:
+            await self.__resync(subscription)
+
+    async def start(self):
+        self.__running = True
+        for connection in self.__connections:
+            if connection.task is None:
+                connection.task = asyncio.ensure_future(self.__run(connection))
+
+    async def close(self):
+        self.__running = False
+        tasks = [connection.task for connection in self.__connections if connection.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for connection in self.__connections:
+            connection.task = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> StreamUpdate:
+        return await self.__queue.get()
+
+    async def __run(self, connection: _StreamConnection):
+        delay = self.__reconnect_delay
+        while self.__running:
+            url = self.__urls[connection.route] + "?streams=" + "/".join(connection.names)
+            try:
+                async with websockets.connect(url, max_size=None) as websocket:
+                    connection.websocket = websocket
+                    self.connects += 1
+                    delay = self.__reconnect_delay
+                    for name in connection.names:
+                        subscription = self.__subscriptions[name]
+                        if subscription.book is not None:
+                            asyncio.ensure_future(self.__resync(subscription))
+                    async for message in websocket:
+                        await self.__dispatch(json.loads(message))
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self.last_error = error
+            finally:
+                connection.websocket = None
+            if self.__running:
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, self.__max_reconnect_delay)
+
+    async def __resync(self, subscription: _StreamSubscription):
+        # buffer diffs while a fresh snapshot is fetched, then replay the newer ones on top of it
+        if subscription.resyncing:
+            return
+        subscription.resyncing = True
+        subscription.buffer = []
+        loop = asyncio.get_running_loop()
+        delay = self.__reconnect_delay
+        try:
+            while self.__running:
+                try:
+                    await loop.run_in_executor(None, self.__client.market_local_order_book, subscription.symbol,
+                                               subscription.depth_limit, subscription.book)
+                except Exception as error:
+                    self.last_error = error
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.__max_reconnect_delay)
+                    continue
+                buffered, subscription.buffer = subscription.buffer, None
+                if all(self.__apply_depth(subscription, data) for data in buffered):
+                    return
+                # the snapshot is older than the first buffered diff: fetch again
+                subscription.buffer = []
+        finally:
+            subscription.resyncing = False
+
+    @staticmethod
+    def __apply_depth(subscription: _StreamSubscription, data: dict) -> bool:
+        try:
+            subscription.book.apply_diff(data["b"], data["a"], data.get("U"), data.get("u"))
+            return True
+        except OrderBookGapError:
+            return False
+
+    async def __dispatch(self, message: dict):
+        subscription = self.__subscriptions.get(message.get("stream"))
+        if subscription is None:
+            return
+        data = message["data"]
+        if subscription.book is not None:
+            if subscription.buffer is not None:
+                subscription.buffer.append(data)
+                return
+            if not self.__apply_depth(subscription, data):
+                asyncio.ensure_future(self.__resync(subscription))
+                return
+        update = StreamUpdate(subscription.kind, subscription.symbol, data, subscription.book)
+        if subscription.callback is not None:
+            try:
+                result = subscription.callback(update)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as error:
+                self.last_error = error
+                self.callback_errors += 1
+        if self.__queue.full():
+            self.__queue.get_nowait()
+        self.__queue.put_nowait(update)
+
+
+class AsyncTokoCrypto:
+    """
+    asyncio counterpart of BaseTokoCrypto built on aiohttp; every endpoint method is a coroutine with the same
+    arguments and returns the decoded json body. Symbol routing (Tokocrypto vs Binance) is loaded on first use.
+    """
+    def __init__(self, api_key: str = None, secret_key: str = None, session=None, timeout=DEFAULT_TIMEOUT,
+                 limit: int = DEFAULT_ASYNC_POOL_LIMIT, limit_per_host: int = DEFAULT_POOL_MAXSIZE,
+                 symbols: SymbolIndex = None, clock: ClockSync = None):
+        """
+        :param api_key:
+        :param secret_key:
+        :param session: shared aiohttp.ClientSession; a private one is created (and owned) on first request if not sent
+        :param timeout: total seconds per request
+        :param limit: maximum number of pooled connections, ignored when session is sent
+        :param limit_per_host: maximum number of pooled connections per host, ignored when session is sent
+        :param symbols: shared SymbolIndex, a private one is created if not sent
+        :param clock: shared ClockSync stamping signed requests, a private one (sampling from its own thread) is
+        created if not sent
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncTokoCrypto requires aiohttp, install it with `pip install aiohttp`")
+        self.__api_key = api_key
+        self.__secret_key = secret_key
+        self.__headers = {"X-MBX-APIKEY": self.__api_key}
+        self.__signer = _Signer(secret_key) if secret_key is not None else None
+        self.__timeout = aiohttp.ClientTimeout(total=timeout)
+        self.__limit = limit
+        self.__limit_per_host = limit_per_host
+        self.__owns_session = session is None
+        self.__session = session
+        self.__symbols = symbols if symbols is not None else SymbolIndex()
+        self.__refresh_task = None
+        self.__owns_clock = clock is None
+        self.__clock = clock if clock is not None else ClockSync(timeout=timeout)
+
+    async def close(self):
+        # Release pooled connections, a shared session is left open for its other clients.
+        if self.__owns_clock:
+            self.__clock.stop()
+        if self.__owns_session and self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def __get_session(self):
+        # The session binds to the running loop, so it is created lazily from inside a coroutine.
+        if self.__session is None:
+            connector = aiohttp.TCPConnector(limit=self.__limit, limit_per_host=self.__limit_per_host)
+            self.__session = aiohttp.ClientSession(connector=connector, timeout=self.__timeout)
+        return self.__session
+
+    async def __refresh_symbols(self, background: bool = False):
+        # the caller must have claimed the refresh on the index
+        try:
+            response = await self.general_supported_trading_symbol()
+            self.__symbols.update(response["data"]["list"])
+        except Exception:
+            if not background:
+                raise
+        finally:
+            self.__symbols.release_refresh()
+
+    async def __route(self, symbol: str, endpoint_url: str, binance_url: str):
+        route = self.__symbols.get(symbol)
+        if route is None:
+            # one refresh, the other coroutines wait for it (or for another client's refresh of a shared index)
+            if self.__symbols.claim_refresh():
+                self.__refresh_task = asyncio.ensure_future(self.__refresh_symbols())
+                await self.__refresh_task
+            elif self.__refresh_task is not None and not self.__refresh_task.done():
+                await asyncio.shield(self.__refresh_task)
+            elif self.__symbols.refreshing:
+                await asyncio.get_running_loop().run_in_executor(None, self.__symbols.wait_refresh)
+            route = self.__symbols.get(symbol)
+            if route is None:
+                raise KeyError(symbol)
+        elif self.__symbols.stale and self.__symbols.claim_refresh(background=True):
+            self.__refresh_task = asyncio.ensure_future(self.__refresh_symbols(background=True))
+        route, symbol = route
+        if route == ROUTE_BINANCE:
+            return binance_url, symbol
+        return BASE_URL + endpoint_url, symbol
+
+    async def __request(self, method: str, payload: dict, endpoint_url: str, signed: bool):
+        plan = _get_plan(method, endpoint_url, signed)
+        # the query string is sent exactly as it was signed
+        url = URL(plan.prepare(payload, self.__signer), encoded=True)
+        headers = self.__headers if signed else None
+        async with self.__get_session().request(plan.method, url, headers=headers) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def general_check_server_time(self) -> datetime:
+        # Test connectivity to the Rest API and get the current server time.
+        response = await self.__request(method="get", payload={}, endpoint_url=BASE_URL + GENERAL_CHECK_SERVER_TIME_URL,
+                                         signed=False)
+        return datetime.fromtimestamp(int(response["timestamp"]) / 1000)
+
+    async def general_supported_trading_symbol(self):
+        # This endpoint returns all Exchange's supported trading symbol.
+        return await self.__request(method="get", payload={}, signed=False,
+                                    endpoint_url=BASE_URL + GENERAL_SUPPORTED_TRADING_SYMBOL_URL)
+
+    async def market_order_book(self, symbol: str, limit: int = None):
+        endpoint_url, symbol = await self.__route(symbol, MARKET_ORDER_BOOK_URL, MARKET_ORDER_BOOK_BINANCE_URL)
+        payload = {
+            "symbol": symbol,
+            "limit": limit
+        }
+        return await self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=False)
+
+    async def market_recent_trades_list(self, symbol: str, from_id: int = None, limit: int = None):
+        endpoint_url, symbol = await self.__route(symbol, MARKET_RECENT_TRADES_LIST_URL,
+                                                  MARKET_RECENT_TRADES_LIST_BINANCE_URL)
+        payload = {
+            "symbol": symbol,
+            "fromId": from_id,
+            "limit": limit
+        }
+        return await self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=False)
+
+    async def market_aggregate_trade_list(self, symbol: str, from_id: int = None, start_time: int = None,
+                                          end_time: int = None, limit: int = None):
+        endpoint_url, symbol = await self.__route(symbol, MARKET_AGGREGATE_TRADE_LIST_URL,
+                                                  MARKET_AGGREGATE_TRADE_LIST_BINANCE_URL)
+        payload = {
+            "symbol": symbol,
+            "fromId": from_id,
+            "startTime": start_time,
+            "endTime": end_time,
+            "limit": limit
+        }
+        return await self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=False)
+
+    async def market_candlestick_data(self, symbol: str, interval: str, start_time: int = None, end_time: int = None,
+                                      limit: int = 500):
+        endpoint_url, symbol = await self.__route(symbol, MARKET_CANDLESTICK_DATA_URL,
+                                                  MARKET_CANDLESTICK_DATA_BINANCE_URL)
+        payload = {
+            "symbol": symbol,
+            "interval": interval,
+            "startTime": start_time,
+            "endTime": end_time,
+            "limit": limit
+        }
+        return await self.__request(method="get", payload=payload, endpoint_url=endpoint_url, signed=False)
+
+    async def account_new_order(self, symbol: str, side: int, type_: int, time_in_force: int = None,
+                                quantity: str = None, quote_order_qty: str = None, price: str = None,
+                                client_id: str = None, stop_price: str = None, iceberg_qty: str = None,
+                                recv_window: int = 5000):
+        # See BaseTokoCrypto.account_new_order for the parameters.
+        payload = {
+            "symbol": symbol,
+            "side": side,
+            "type": type_,
+            "timeInForce": time_in_force,
+            "quantity": quantity,
+            "quoteOrderQty": quote_order_qty,
+            "price": price,
+            "clientId": client_id,
+            "stopPrice": stop_price,
+            "icebergQty": iceberg_qty,
+            "recvWindow": recv_window,
+            "timestamp": self.__clock.timestamp()
+        }
+        return await self.__request(method="post", payload=payload, endpoint_url=BASE_URL + ACCOUNT_NEW_ORDER_URL,
+                                    signed=True)
+
+    async def account_query_order(self, order_id: int = None, client_id: str = None, recv_window: int = 5000):
+        payload = {
+            "orderId": order_id,
+            "clientId": client_id,
+            "recvWindow": recv_window,
+            "timestamp": self.__clock.timestamp()
+        }
+        return await self.__request(method="get", payload=payload, endpoint_url=BASE_URL + ACCOUNT_QUERY_ORDER_URL,
+                                    signed=True)
+
+    async def account_cancel_order(self, order_id: int, recv_window: int = 5000):
+        payload = {
+            "orderId": order_id,
+            "recvWindow": recv_window,
+            "timestamp": self.__clock.timestamp()
+        }
+        return await self.__request(method="post", payload=payload, endpoint_url=BASE_URL + ACCOUNT_CANCEL_ORDER_URL,
+                                    signed=True)
+
+    async def account_all_order(self, symbol: str, side: int = None, type_: int = None, start_time: int = None,
+                                end_time: int = None, from_id: str = None, direct: int = None, limit: int = None,
+                                recv_window: int = 5000):
+        # See BaseTokoCrypto.account_all_order for the parameters.
+        payload = {
+            "symbol": symbol,
+            "type": type_,
+            "side": side,
+            "startTime": start_time,
+            "endTime": end_time,
+            "fromId": from_id,
+            "direct": direct,
+            "limit": limit,
+            "recvWindow": recv_window,
+            "timestamp": self.__clock.timestamp()
+        }
+        return await self.__request(method="get", payload=payload, endpoint_url=BASE_URL + ACCOUNT_ALL_ORDER,
+                                    signed=True)
+
+    async def account_new_oco(self, symbol: str, side: int, quantity: str, price: str, stop_client_id: str = None,
+                              stop_price: str = None, list_client_d: str = None, limit_client_id: str = None,
+                              stop_limit_price: str = None, recv_window: int = 5000):
+        # See BaseTokoCrypto.account_new_oco for the parameters.
+        payload = {
+            "symbol": symbol,
+            "listClientId": list_client_d,
+            "side": side,
+            "quantity": quantity,
+            "limitClientId": limit_client_id,
+            "price": price,
+            "stopClientId": stop_client_id,
+            "stopPrice": stop_price,
+            "stopLimitPrice": stop_limit_price,
+            "recvWindow": recv_window,
+            "timestamp": self.__clock.timestamp()
+        }
+        return await self.__request(method="post", payload=payload, endpoint_url=BASE_URL + ACCOUNT_NEW_OCO,
+                                    signed=True)
+
+    async def account_information(self, recv_window: int = 5000):
+        payload = {
+            "recvWindow": recv_window,
+            "timestamp": self.__clock.timestamp()
+        }
+        return await self.__request(method="get", payload=payload, endpoint_url=BASE_URL + ACCOUNT_INFORMATION_URL,
+                                    signed=True)
+
+    async def account_asset_information(self, asset: str, recv_window: int = 5000):
+        payload = {
+            "asset": asset,
+            "recvWindow": recv_window,
+            "timestamp": self.__clock.timestamp()
+        }
+        return await self.__request(method="get", payload=payload, signed=True,
+                                    endpoint_url=BASE_URL + ACCOUNT_ASSET_INFORMATION_URL)
+
+    async def account_trade_list(self, symbol: str, order_id: str = None, start_time: int = None,
+                                 end_time: int = None, from_id: int = None, direct: int = None,
+                                 rebate_status: int = None, limit: int = 500, recv_window: int = 5000):
+        payload = {
+            "asset": symbol,
+            "orderId": order_id,
+            "startTime": start_time,
+            "endTime": end_time,
+            "fromId": from_id,
+            "direct": direct,
+            "limit": limit,
+            "recvWindow": recv_window,
+            "timestamp": self.__clock.timestamp(),
+            "rebateStatus": rebate_status
+        }
+        return await self.__request(method="get", payload=payload, endpoint_url=BASE_URL + ACCOUNT_TRADE_LIST_URL,
+                                    signed=True)
+
+    async def wallet_withdraw(self, asset: str, address: str, amount: str, client_id: str = None,
+                              network: str = None, address_tag: str = None, recv_window: int = 5000):
+        payload = {
+            "asset": asset,
+            "clientId": client_id,
+            "network": network,
+            "address": address,
+            "addressTag": address_tag,
+            "amount": amount,
+            "recvWindow": recv_window,
+            "timestamp": self.__clock.timestamp()
+        }
+        return await self.__request(method="post", payload=payload, endpoint_url=BASE_URL + WALLET_WITHDRAW_URL,
+                                    signed=True)
+
+    async def wallet_withdraw_history(self, asset: str = None, status: int = None, from_id: int = None,
+                                      start_time: int = None, end_time: int = None, recv_window: int = 5000):
+        payload = {
+            "asset": asset,
+            "status": status,
+            "fromId": from_id,
+            "startTime": start_time,
+            "endTime": end_time,
+            "recvWindow": recv_window,
+            "timestamp": self.__clock.timestamp()
+        }
+        return await self.__request(method="get", payload=payload, signed=True,
+                                    endpoint_url=BASE_URL + WALLET_WITHDRAW_HISTORY_URL)
+
+    async def wallet_deposit_history(self, asset: str = None, status: int = None, from_id: int = None,
+                                     start_time: int = None, end_time: int = None, recv_window: int = 5000):
+        payload = {
+            "asset": asset,
+            "status": status,
+            "fromId": from_id,
+            "startTime": start_time,
+            "endTime": end_time,
+            "recvWindow": recv_window,
+            "timestamp": self.__clock.timestamp()
+        }
+        return await self.__request(method="get", payload=payload, signed=True,
+                                    endpoint_url=BASE_URL + WALLET_DEPOSIT_HISTORY_URL)
+
+    async def wallet_deposit_address(self, asset: str, network: str, recv_window: int = 5000):
+        payload = {
+            "asset": asset,
+            "network": network,
+            "recvWindow": recv_window,
+            "timestamp": self.__clock.timestamp()
+        }
+        return await self.__request(method="get", payload=payload, signed=True,
+                                    endpoint_url=BASE_URL + WALLET_DEPOSIT_ADDRESS_URL)
+
+    @property
+    def api_key(self) -> str:
+        return self.__api_key
+
+    @property
+    def secret_key(self) -> str:
+        return self.__secret_key
+
+    @property
+    def symbols(self) -> SymbolIndex:
+        return self.__symbols
+
+    @property
+    def symbol_type(self) -> dict:
+        return self.__symbols.symbol_type